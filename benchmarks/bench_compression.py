@@ -0,0 +1,75 @@
+# benchmarks/bench_compression.py
+#
+# Show the CPU-versus-bytes tradeoff of every compression level on real
+# response bodies: the /tasks/ HTML, a page of API JSON and an NDJSON
+# export.
+#
+#   python benchmarks/bench_compression.py [tasks] [repeats]
+#
+# Brotli levels are included when the brotli module is installed.
+
+
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project import app, db
+from project.compression import brotli, compress
+
+from suite import seed
+
+
+def bodies(client):
+    client.post('/', data={'name': 'bench', 'password': 'benchmark'})
+    return [
+        ('tasks.html', client.get('/tasks/').data),
+        ('api page', client.get('/api/v2/tasks/?limit=100').data),
+        ('export', client.get('/api/v2/tasks/export').data),
+    ]
+
+
+def levels():
+    for level in range(1, 10):
+        yield 'gzip', level
+    if brotli is not None:
+        for level in range(0, 12):
+            yield 'br', level
+
+
+def main(tasks=2000, repeats=5):
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False,
+                      SQL_INSTRUMENTATION=False,
+                      SQLALCHEMY_DATABASE_URI='sqlite:///' + path)
+    try:
+        with app.app_context():
+            seed(tasks, users=10)
+            samples = bodies(app.test_client())
+            db.session.remove()
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    print('{:<12} {:<5} {:>5} {:>10} {:>9} {:>9} {:>9}'.format(
+        'body', 'enc', 'level', 'bytes', 'ratio', 'ms', 'MB/s'))
+    for name, data in samples:
+        print('{:<12} {:<5} {:>5} {:>10,} {:>9} {:>9} {:>9}'.format(
+            name, '-', '-', len(data), '1.00', '-', '-'))
+        for encoding, level in levels():
+            out = compress(encoding, level, data)
+            seconds = min(timeit.repeat(
+                lambda: compress(encoding, level, data),
+                number=1, repeat=repeats))
+            print('{:<12} {:<5} {:>5} {:>10,} {:>9.2f} {:>9.2f} {:>9.1f}'
+                  .format(name, encoding, level, len(out),
+                          float(len(data)) / len(out), seconds * 1000,
+                          len(data) / seconds / 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,84 @@
+# benchmarks/bench_serializer.py
+#
+# Compare rows per second for serializing tasks from full ORM instances
+# against the column projection in project/serializers.py.
+#
+#   python benchmarks/bench_serializer.py [rows] [repeats]
+
+
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project import app, db
+from project.models import Task
+from project.serializers import task_query, task_to_dict
+
+
+def orm_path():
+    json_results = []
+    for result in db.session.query(Task).all():
+        json_results.append({
+            'task_id': result.task_id,
+            'task_name': result.name,
+            'due_date': str(result.due_date),
+            'priority': result.priority,
+            'posted date': str(result.posted_date),
+            'status': result.status,
+            'user id': result.user_id
+        })
+    return json_results
+
+
+def projection_path():
+    return [task_to_dict(row) for row in task_query()]
+
+
+def seed(rows):
+    db.session.execute(Task.__table__.insert(), [
+        {'name': 'task {}'.format(i), 'due_date': date(2015, 1 + i % 12, 1),
+         'priority': 1 + i % 10, 'posted_date': date(2015, 1, 1),
+         'status': i % 2, 'user_id': 1}
+        for i in range(rows)])
+    db.session.commit()
+
+
+def best_rate(fn, rows, repeats):
+    best = None
+    for _ in range(repeats):
+        db.session.expunge_all()
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return rows / best
+
+
+def main(rows=50000, repeats=5):
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    try:
+        with app.app_context():
+            db.create_all()
+            seed(rows)
+            assert orm_path() == projection_path()
+            orm = best_rate(orm_path, rows, repeats)
+            projection = best_rate(projection_path, rows, repeats)
+            db.session.remove()
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    print('{:>12} {:>14}'.format('path', 'rows/sec'))
+    print('{:>12} {:>14,.0f}'.format('orm', orm))
+    print('{:>12} {:>14,.0f}'.format('projection', projection))
+    print('speedup: {:.2f}x'.format(projection / orm))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,131 @@
+# benchmarks/bench_templates.py
+#
+# Compare the first render of each page in a fresh worker with and
+# without the template bytecode cache.
+#
+#   python benchmarks/bench_templates.py [--runs 10]
+#
+# Every run starts a new interpreter per mode and times the first and
+# second request for login.html, register.html and tasks.html:
+#
+#   none   TEMPLATE_CACHE_DIR is empty, every template is compiled
+#   cold   an empty cache directory, compiled and written to disk
+#   warm   a directory filled by `python -m project.templating`
+#
+# The second request is the steady state once the worker has the
+# template in memory.  _base.html is loaded by the first page, so its
+# cost shows up under login.html.
+
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PAGES = ('login.html', 'register.html', 'tasks.html')
+MODES = ('none', 'cold', 'warm')
+
+# runs in the child; prints {template: [first, second]} seconds
+FIRST_RENDER = r'''
+import json, time
+from project import app
+client = app.test_client()
+
+def twice(url):
+    timings = []
+    for _ in range(2):
+        start = time.time()
+        client.get(url)
+        timings.append(time.time() - start)
+    return timings
+
+timings = {'login.html': twice('/'), 'register.html': twice('/register/')}
+client.post('/', data={'name': 'bench', 'password': 'benchmark'})
+timings['tasks.html'] = twice('/tasks/')
+print(json.dumps(timings))
+'''
+
+
+def scratch_settings(directory, tasks):
+    """Point the children at a seeded scratch database."""
+    settings = os.path.join(directory, 'settings.py')
+    with open(settings, 'w') as f:
+        f.write("import os\n")
+        f.write("SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'\n".format(
+            os.path.join(directory, 'templates.db')))
+        f.write("METRICS_DIR = '{}'\n".format(
+            os.path.join(directory, 'metrics')))
+        f.write("TASK_CACHE_STAMP = '{}'\n".format(
+            os.path.join(directory, 'task_cache.stamp')))
+        f.write("WTF_CSRF_ENABLED = False\n")
+        f.write("TEMPLATE_CACHE_DIR = "
+                "os.environ.get('BENCH_TEMPLATE_CACHE', '')\n")
+    env = dict(os.environ, FLASKTASKR_SETTINGS=settings)
+    subprocess.check_call(
+        [sys.executable, '-c',
+         'import sys; sys.path.insert(0, "benchmarks")\n'
+         'from project import app, db\n'
+         'from suite import seed\n'
+         'with app.app_context(): seed({}, users=10)'.format(tasks)],
+        cwd=ROOT, env=env)
+    return env
+
+
+def first_render(env, cache):
+    output = subprocess.check_output(
+        [sys.executable, '-c', FIRST_RENDER], cwd=ROOT,
+        env=dict(env, BENCH_TEMPLATE_CACHE=cache))
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def run(runs, env, directory):
+    warm = os.path.join(directory, 'warm')
+    subprocess.check_call(
+        [sys.executable, '-m', 'project.templating'], cwd=ROOT,
+        env=dict(env, BENCH_TEMPLATE_CACHE=warm), stdout=subprocess.PIPE)
+    samples = dict((mode, []) for mode in MODES)
+    # alternate the modes so drift in machine load hits all of them
+    for _ in range(runs):
+        cold = tempfile.mkdtemp(dir=directory)
+        samples['none'].append(first_render(env, ''))
+        samples['cold'].append(first_render(env, cold))
+        samples['warm'].append(first_render(env, warm))
+        shutil.rmtree(cold)
+
+    def median(mode, page, index):
+        values = sorted(s[page][index] for s in samples[mode])
+        return values[runs // 2] * 1000
+
+    print('first request, median ms of {} runs'.format(runs))
+    print('{:<16} {:>8} {:>8} {:>8} {:>8}'.format(
+        'template', 'none', 'cold', 'warm', 'steady'))
+    for page in PAGES:
+        print('{:<16} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f}'.format(
+            page, median('none', page, 0), median('cold', page, 0),
+            median('warm', page, 0), median('warm', page, 1)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time first renders with and without the template '
+                    'bytecode cache.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--tasks', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        env = scratch_settings(directory, args.tasks)
+        run(args.runs, env, directory)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+# benchmarks/generate_dataset.py
+#
+# Build a production-sized SQLite database of synthetic users and tasks.
+#
+#   python benchmarks/generate_dataset.py big.db --tasks 10000000 --users 5000
+#
+# The schema comes from project/models.py.  Its indexes are dropped while
+# rows are streamed in with executemany inside one transaction (journal
+# and fsync off, since a half-written file is simply regenerated), then
+# rebuilt and ANALYZEd.  The triggers on tasks are dropped the same way and
+# the search index and task counts they maintain are rebuilt in one pass
+# at the end.  Every user's password is --password, hashed once.
+
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project import app, db, bcrypt
+from project.models import Task
+from project.stats import ACTUAL_COUNTS_SQL
+
+
+VERBS = ['Review', 'Write', 'Fix', 'Call', 'Email', 'Plan', 'Update',
+         'Schedule', 'Prepare', 'Test', 'Deploy', 'Clean', 'Buy', 'Book',
+         'Refactor', 'Document']
+NOUNS = ['report', 'invoice', 'meeting', 'budget', 'release', 'proposal',
+         'slides', 'database', 'backlog', 'contract', 'groceries', 'flight',
+         'newsletter', 'server', 'roadmap', 'dentist']
+QUALIFIERS = ['quarterly', 'weekly', 'urgent', 'draft', 'final', 'team',
+              'customer', 'annual', 'personal', 'security']
+# share of tasks at each priority 1..10, most in the middle
+PRIORITY_WEIGHTS = [5, 10, 15, 20, 20, 12, 8, 5, 3, 2]
+
+
+def weighted_table(weights, values, size=1000):
+    """Precompute a lookup table so sampling is one randrange."""
+    total = float(sum(weights))
+    table = []
+    for weight, value in zip(weights, values):
+        table.extend([value] * int(round(size * weight / total)))
+    return table
+
+
+def user_rows(users, password_hash):
+    for i in range(1, users + 1):
+        yield ('user{}'.format(i), 'user{}@example.com'.format(i),
+               password_hash, 'admin' if i == 1 else 'user')
+
+
+def task_rows(tasks, users, anchor, seed):
+    rng = random.Random(seed)
+    rand, randrange, gauss = rng.random, rng.randrange, rng.gauss
+    days = dict((offset, (anchor + timedelta(days=offset)).isoformat())
+                for offset in range(-800, 801))
+    priorities = weighted_table(PRIORITY_WEIGHTS, range(1, 11))
+    n_priorities = len(priorities)
+    for i in range(tasks):
+        # due dates cluster around the anchor; most past-due work is done
+        due = max(-730, min(730, int(gauss(0, 120))))
+        posted = due - randrange(1, 60)
+        closed = rand() < (0.85 if due < 0 else 0.1)
+        name = '{} {} {} {}'.format(
+            VERBS[randrange(16)], QUALIFIERS[randrange(10)],
+            NOUNS[randrange(16)], i)
+        # a few heavy users own most of the tasks
+        owner = 1 + int(users * rand() ** 3)
+        yield (name, days[due], priorities[randrange(n_priorities)],
+               days[posted], 0 if closed else 1, owner)
+
+
+def progress(rows, every, label, out):
+    start = time.time()
+    for n, row in enumerate(rows, 1):
+        if n % every == 0:
+            out.write('{}: {:,} rows ({:,.0f} rows/s)\n'.format(
+                label, n, n / (time.time() - start)))
+        yield row
+
+
+def generate(path, tasks, users, password='password', seed=0,
+             anchor=None, out=sys.stderr):
+    if os.path.exists(path):
+        raise SystemExit('{} already exists'.format(path))
+    anchor = anchor or date.today()
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+        os.path.abspath(path)
+    with app.app_context():
+        db.create_all()
+        db.session.remove()
+        db.get_engine(app).dispose()
+
+    indexes = list(Task.__table__.indexes)
+    connection = sqlite3.connect(path, isolation_level=None)
+    try:
+        connection.execute('PRAGMA journal_mode=OFF')
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.execute('PRAGMA cache_size=-262144')
+        for index in indexes:
+            connection.execute('DROP INDEX IF EXISTS {}'.format(index.name))
+        triggers = connection.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+            "AND tbl_name = 'tasks'").fetchall()
+        for name, _ in triggers:
+            connection.execute('DROP TRIGGER {}'.format(name))
+
+        start = time.time()
+        connection.execute('BEGIN')
+        connection.executemany(
+            'INSERT INTO users (name, email, password, role) '
+            'VALUES (?, ?, ?, ?)',
+            user_rows(users, bcrypt.generate_password_hash(password)))
+        connection.executemany(
+            'INSERT INTO tasks (name, due_date, priority, posted_date, '
+            'status, user_id) VALUES (?, ?, ?, ?, ?, ?)',
+            progress(task_rows(tasks, users, anchor, seed),
+                     max(tasks // 10, 1), 'tasks', out))
+        connection.execute('COMMIT')
+        out.write('loaded in {:.1f}s\n'.format(time.time() - start))
+
+        start = time.time()
+        for index in indexes:
+            connection.execute('CREATE INDEX {} ON tasks ({})'.format(
+                index.name, ', '.join(c.name for c in index.columns)))
+        connection.execute(
+            "INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+        connection.execute('INSERT INTO task_counts (dimension, key, '
+                           'status, count) ' + ACTUAL_COUNTS_SQL)
+        for _, sql in triggers:
+            connection.execute(sql)
+        connection.execute('ANALYZE')
+        out.write('indexed in {:.1f}s\n'.format(time.time() - start))
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic flasktaskr database.')
+    parser.add_argument('path')
+    parser.add_argument('--tasks', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    generate(args.path, args.tasks, args.users, args.password, args.seed)
+
+
+if __name__ == '__main__':
+    main()
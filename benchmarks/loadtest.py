@@ -0,0 +1,282 @@
+# benchmarks/loadtest.py
+#
+# Start the app under gunicorn on a scratch database and drive it with
+# many concurrent clients replaying a weighted mix of requests.
+#
+#   python benchmarks/loadtest.py --workers 4 --clients 32 --duration 30
+#   python benchmarks/loadtest.py --mix login=1,tasks=4,api_read=4,api_write=1
+#   python benchmarks/loadtest.py --out run.json --compare previous.json
+#
+# The report gives throughput, p50/p95/p99 latency and the error rate for
+# each kind of request and overall.  --out saves it, with the current git
+# commit, as JSON; --compare prints the change against an earlier report.
+
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'benchmark'
+CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+#################
+#### server #####
+#################
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def prepare_database(directory, tasks):
+    """Write a settings file for a scratch database and seed it."""
+    settings = os.path.join(directory, 'settings.py')
+    with open(settings, 'w') as f:
+        f.write("SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'\n".format(
+            os.path.join(directory, 'loadtest.db')))
+        f.write("METRICS_DIR = '{}'\n".format(
+            os.path.join(directory, 'metrics')))
+        f.write("TASK_CACHE_STAMP = '{}'\n".format(
+            os.path.join(directory, 'task_cache.stamp')))
+    os.environ['FLASKTASKR_SETTINGS'] = settings
+    sys.path.insert(0, ROOT)
+    from project import app, db
+    from suite import seed
+    with app.app_context():
+        seed(tasks, users=100)
+        db.session.remove()
+    return settings
+
+
+def start_gunicorn(settings, workers, port):
+    env = dict(os.environ, FLASKTASKR_SETTINGS=settings)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn.app.wsgiapp',
+         '--config', 'gunicorn_config.py',
+         '--workers', str(workers), '--bind', '127.0.0.1:{}'.format(port),
+         '--log-level', 'warning', '--access-logfile', os.devnull,
+         'wsgi:app'],
+        cwd=ROOT, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return process
+        except socket.error:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start listening on {}'.format(port))
+
+
+#################
+#### client #####
+#################
+
+class Client(object):
+    """One simulated user with its own cookies and API token.
+
+    Each request kind returns whether it succeeded.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.http = requests.Session()
+        self.logged_in = False
+        self.token = None
+
+    def login(self):
+        page = self.http.get(self.base + '/')
+        match = CSRF.search(page.text)
+        response = self.http.post(self.base + '/', data={
+            'csrf_token': match.group(1) if match else '',
+            'name': 'bench', 'password': PASSWORD}, allow_redirects=False)
+        # a failed login renders the form again with a 200
+        self.logged_in = response.status_code == 302
+        return self.logged_in
+
+    def tasks(self):
+        if not self.logged_in and not self.login():
+            return False
+        response = self.http.get(self.base + '/tasks/',
+                                 allow_redirects=False)
+        # a redirect back to the login form means the session is gone
+        self.logged_in = response.status_code != 302
+        return response.status_code == 200
+
+    def api_read(self):
+        return self.http.get(self.base + '/api/v2/tasks/', params={
+            'status': random.choice([0, 1]), 'sort': 'due_date',
+            'limit': 50}).ok
+
+    def api_write(self):
+        if self.token is None:
+            response = self.http.post(self.base + '/api/v2/token',
+                                      auth=('bench', PASSWORD))
+            if not response.ok:
+                return False
+            self.token = response.json()['token']
+        response = self.http.post(
+            self.base + '/api/v2/tasks/',
+            headers={'Authorization': 'Bearer ' + self.token},
+            json={'name': 'load test task', 'due_date': '05/25/2018',
+                  'priority': random.randint(1, 10)})
+        if response.status_code == 401:
+            self.token = None
+        return response.ok
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        name, weight = part.split('=')
+        if not hasattr(Client, name):
+            raise ValueError('unknown request kind: {}'.format(name))
+        mix.append((name, float(weight)))
+    return mix
+
+
+def drive(base, mix, deadline, samples):
+    client = Client(base)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    total = sum(weights)
+    while time.time() < deadline:
+        pick = random.uniform(0, total)
+        for name, weight in zip(names, weights):
+            pick -= weight
+            if pick <= 0:
+                break
+        start = time.time()
+        try:
+            ok = getattr(client, name)()
+        except Exception:
+            # a dropped connection or a malformed body is an error sample,
+            # not the end of this client
+            ok = False
+        samples.append((name, time.time() - start, ok))
+
+
+#################
+#### report #####
+#################
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(samples, duration):
+    report = {}
+    kinds = sorted(set(s[0] for s in samples)) + ['all']
+    for kind in kinds:
+        rows = [s for s in samples if kind == 'all' or s[0] == kind]
+        latencies = sorted(s[1] for s in rows)
+        errors = sum(1 for s in rows if not s[2])
+        report[kind] = {
+            'requests': len(rows),
+            'throughput': len(rows) / duration,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'error_rate': float(errors) / len(rows) if rows else 0.0,
+        }
+    return report
+
+
+def print_report(report, previous=None):
+    header = '{:<10} {:>9} {:>10} {:>9} {:>9} {:>9} {:>7}'
+    print(header.format('kind', 'requests', 'req/s', 'p50 ms', 'p95 ms',
+                        'p99 ms', 'errors'))
+    for kind in sorted(report, key=lambda k: (k == 'all', k)):
+        r = report[kind]
+        print('{:<10} {:>9} {:>10.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>6.1%}'
+              .format(kind, r['requests'], r['throughput'], r['p50_ms'],
+                      r['p95_ms'], r['p99_ms'], r['error_rate']))
+        old = (previous or {}).get(kind)
+        if old:
+            print('{:<10} {:>9} {:>+10.1%} {:>+9.1%} {:>+9.1%} {:>+9.1%}'
+                  .format('', '', *[
+                      r[k] / old[k] - 1 if old[k] else 0.0
+                      for k in ('throughput', 'p50_ms', 'p95_ms',
+                                'p99_ms')]))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Load test flasktaskr under gunicorn.')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--tasks', type=int, default=10000,
+                        help='tasks to seed the scratch database with')
+    parser.add_argument('--mix', default='login=1,tasks=4,api_read=4,'
+                                         'api_write=1')
+    parser.add_argument('--out', help='write the report to this JSON file')
+    parser.add_argument('--compare', help='earlier JSON report to diff')
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+
+    directory = tempfile.mkdtemp()
+    process = None
+    try:
+        settings = prepare_database(directory, args.tasks)
+        port = free_port()
+        process = start_gunicorn(settings, args.workers, port)
+        base = 'http://127.0.0.1:{}'.format(port)
+        samples = []
+        deadline = time.time() + args.duration
+        clients = [threading.Thread(target=drive,
+                                    args=(base, mix, deadline, samples))
+                   for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(directory)
+
+    report = summarize(samples, args.duration)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['report']
+    print_report(report, previous)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'commit': git_commit(), 'workers': args.workers,
+                       'clients': args.clients, 'duration': args.duration,
+                       'mix': args.mix, 'report': report}, f, indent=2,
+                      sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+# benchmarks/startup.py
+#
+# Measure what a fresh worker pays before it can serve a request.
+#
+#   python benchmarks/startup.py report [--top 15]
+#   python benchmarks/startup.py coldstart [--runs 10]
+#
+# "report" shows where `import project` spends its time, grouped by top
+# level package.  On Python 3.7+ it reads the output of `python -X
+# importtime`; older interpreters are profiled with an __import__ hook.
+#
+# "coldstart" starts --runs fresh interpreters for each blueprint mode
+# (eager, and LAZY_API_BLUEPRINTS) and times the import, the first page
+# request and the first API request.
+
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in the child; prints {module: self seconds} for `import project`
+IMPORT_HOOK = r'''
+import json, sys, time
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+real_import = builtins.__import__
+stack = [0.0]
+self_time = {}
+
+def timed_import(name, *args, **kwargs):
+    if name in sys.modules:
+        return real_import(name, *args, **kwargs)
+    start = time.time()
+    stack.append(0.0)
+    module = None
+    try:
+        module = real_import(name, *args, **kwargs)
+        return module
+    finally:
+        elapsed = time.time() - start
+        children = stack.pop()
+        stack[-1] += elapsed
+        # relative imports pass a partial name; the module knows its own
+        name = getattr(module, '__name__', None) or name or '?'
+        self_time[name] = self_time.get(name, 0.0) + elapsed - children
+
+builtins.__import__ = timed_import
+import project
+builtins.__import__ = real_import
+sys.stderr.write(json.dumps(self_time))
+'''
+
+# runs in the child; prints the three timings as JSON
+COLD_START = r'''
+import json, sys, time
+start = time.time()
+from project import app
+imported = time.time()
+client = app.test_client()
+client.get('/')
+page = time.time()
+client.get('/api/v2/tasks/')
+api = time.time()
+print(json.dumps({'import': imported - start, 'first_page': page - start,
+                  'first_api': api - start}))
+'''
+
+
+def importtime_self_times(env):
+    """{module: self seconds} from `python -X importtime`."""
+    output = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', 'import project'],
+        cwd=ROOT, env=env, stderr=subprocess.PIPE).communicate()[1]
+    times = {}
+    for line in output.decode().splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(self_us) / 1e6
+    return times
+
+
+def hook_self_times(env):
+    output = subprocess.Popen(
+        [sys.executable, '-c', IMPORT_HOOK], cwd=ROOT, env=env,
+        stderr=subprocess.PIPE).communicate()[1]
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def report(top, env):
+    if sys.version_info >= (3, 7):
+        times = importtime_self_times(env)
+    else:
+        times = hook_self_times(env)
+    packages = {}
+    for name, seconds in times.items():
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0.0) + seconds
+    total = sum(packages.values())
+    print('import project: {:.0f} ms'.format(total * 1000))
+    print('{:<24} {:>9} {:>7}'.format('package', 'ms', 'share'))
+    for package, seconds in sorted(packages.items(),
+                                   key=lambda p: -p[1])[:top]:
+        print('{:<24} {:>9.1f} {:>6.1%}'.format(
+            package, seconds * 1000, seconds / total))
+
+
+def cold_start(runs, env):
+    modes = (('eager', False), ('lazy', True))
+    samples = dict((mode, []) for mode, _ in modes)
+    # alternate the modes so drift in machine load hits both equally
+    for _ in range(runs):
+        for mode, lazy in modes:
+            output = subprocess.check_output(
+                [sys.executable, '-c', COLD_START], cwd=ROOT,
+                env=dict(env, STARTUP_LAZY_APIS=str(lazy)))
+            samples[mode].append(json.loads(output.decode()))
+    results = {}
+    for mode, _ in modes:
+        results[mode] = dict(
+            (key, sorted(s[key] for s in samples[mode])[runs // 2])
+            for key in ('import', 'first_page', 'first_api'))
+    print('{:<8} {:>10} {:>12} {:>11}   (median ms of {} runs)'.format(
+        'mode', 'import', 'first page', 'first api', runs))
+    for mode, _ in modes:
+        r = results[mode]
+        print('{:<8} {:>10.1f} {:>12.1f} {:>11.1f}'.format(
+            mode, r['import'] * 1000, r['first_page'] * 1000,
+            r['first_api'] * 1000))
+    return results
+
+
+def scratch_settings(directory):
+    """Point the children at a scratch database and metrics directory."""
+    settings = os.path.join(directory, 'settings.py')
+    with open(settings, 'w') as f:
+        f.write("import os\n")
+        f.write("SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'\n".format(
+            os.path.join(directory, 'startup.db')))
+        f.write("METRICS_DIR = '{}'\n".format(
+            os.path.join(directory, 'metrics')))
+        f.write("TASK_CACHE_STAMP = '{}'\n".format(
+            os.path.join(directory, 'task_cache.stamp')))
+        f.write("LAZY_API_BLUEPRINTS = "
+                "os.environ.get('STARTUP_LAZY_APIS') == 'True'\n")
+    env = dict(os.environ, FLASKTASKR_SETTINGS=settings)
+    subprocess.check_call(
+        [sys.executable, '-c', 'from project import db; db.create_all()'],
+        cwd=ROOT, env=env)
+    return env
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Report flasktaskr import and cold start cost.')
+    parser.add_argument('command', choices=['report', 'coldstart'])
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        env = scratch_settings(directory)
+        if args.command == 'report':
+            report(args.top, env)
+        else:
+            cold_start(args.runs, env)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+# benchmarks/suite.py
+#
+# Time the hot paths against generated datasets and compare the results
+# with a saved baseline.
+#
+#   python benchmarks/suite.py --save benchmarks/baseline.json
+#   python benchmarks/suite.py --compare benchmarks/baseline.json
+#   python benchmarks/suite.py --sizes 1000 --repeat 3 --tolerance 0.25
+#
+# Every benchmark reports the best of --repeat runs in seconds.  With
+# --compare the suite exits non-zero when any result is slower than the
+# baseline by more than --tolerance (a fraction, 0.2 == 20%).
+
+
+import argparse
+import base64
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import render_template, session
+
+from project import app, db, bcrypt, password_hasher
+from project.models import Task, User
+from project.pagination import paginate
+from project.serializers import task_query, task_to_dict
+from project.tasks.forms import AddTaskForm
+from project.tasks.views import task_rows, open_tasks, closed_tasks, \
+    section_url, TASK_ORDER
+
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+SEED_CHUNK = 20000
+PASSWORD = 'benchmark'
+
+
+###################
+#### datasets #####
+###################
+
+def seed(rows, users=1000):
+    """Fill the current database with ``rows`` tasks over ``users`` users.
+
+    Only the first user has a real bcrypt hash; the rest are never used
+    to log in, so hashing them would just slow the setup down.
+    """
+    db.create_all()
+    user_rows = [{'name': 'bench', 'email': 'bench@example.com',
+                  'password': bcrypt.generate_password_hash(PASSWORD),
+                  'role': 'admin'}]
+    user_rows.extend({'name': 'user{}'.format(i),
+                      'email': 'user{}@example.com'.format(i),
+                      'password': 'x', 'role': 'user'}
+                     for i in range(1, users))
+    db.session.execute(User.__table__.insert(), user_rows)
+    for start in range(0, rows, SEED_CHUNK):
+        db.session.execute(Task.__table__.insert(), [
+            {'name': 'task {}'.format(i),
+             'due_date': date(2015, 1 + i % 12, 1 + i % 28),
+             'priority': 1 + i % 10,
+             'posted_date': date(2015, 1, 1),
+             'status': i % 2,
+             'user_id': 1 + i % users}
+            for i in range(start, min(start + SEED_CHUNK, rows))])
+    db.session.commit()
+
+
+####################
+#### benchmarks ####
+####################
+
+def bench_serialize_page(client):
+    rows = task_query().order_by(Task.task_id).limit(1000).all()
+    return lambda: [task_to_dict(row) for row in rows]
+
+
+# the first page of each section, as /tasks/ queries it
+def bench_open_tasks_query(client):
+    return lambda: paginate(task_rows('1'), TASK_ORDER,
+                            config_prefix='TASKS')
+
+
+def bench_closed_tasks_query(client):
+    return lambda: paginate(task_rows('0'), TASK_ORDER,
+                            config_prefix='TASKS')
+
+
+def bench_render_tasks_html(client):
+    per_page = app.config['TASKS_PAGE_SIZE']
+    # query now so that only the rendering is timed
+    open_page = open_tasks(None, per_page)
+    closed_page = closed_tasks(None, per_page)
+
+    def render():
+        with app.test_request_context('/tasks/'):
+            session['name'] = 'bench'
+            session['role'] = 'admin'
+            render_template('tasks.html', form=AddTaskForm(),
+                            open_tasks=open_page, closed_tasks=closed_page,
+                            section_url=section_url, username='bench')
+    return render
+
+
+def bench_verify_password(client):
+    pw_hash = User.query.filter_by(name='bench').first().password
+    return lambda: password_hasher.check_password_hash(pw_hash, PASSWORD)
+
+
+def bench_api_v2_get(client):
+    return lambda: client.get('/api/v2/tasks/?limit=100&status=1')
+
+
+def bench_api_v2_post(client):
+    credentials = base64.b64encode('bench:{}'.format(PASSWORD).encode())
+    headers = {'Authorization': 'Basic ' + credentials.decode(),
+               'Content-Type': 'application/json'}
+    body = json.dumps({'name': 'posted', 'due_date': '05/25/2018',
+                       'priority': 1})
+    return lambda: client.post('/api/v2/tasks/', headers=headers, data=body)
+
+
+BENCHMARKS = [
+    ('serialize_page', bench_serialize_page),
+    ('open_tasks_query', bench_open_tasks_query),
+    ('closed_tasks_query', bench_closed_tasks_query),
+    ('render_tasks_html', bench_render_tasks_html),
+    ('verify_password', bench_verify_password),
+    ('api_v2_get', bench_api_v2_get),
+    ('api_v2_post', bench_api_v2_post),
+]
+
+
+#################
+#### runner #####
+#################
+
+def run(sizes, repeat, only=None, out=sys.stderr):
+    results = {}
+    for size in sizes:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        app.config.update(TESTING=True, WTF_CSRF_ENABLED=False,
+                          SQL_INSTRUMENTATION=False,
+                          SQLALCHEMY_DATABASE_URI='sqlite:///' + path)
+        try:
+            with app.app_context():
+                out.write('seeding {} tasks\n'.format(size))
+                seed(size)
+                client = app.test_client()
+                timings = results[str(size)] = {}
+                for name, setup in BENCHMARKS:
+                    if only and name not in only:
+                        continue
+                    fn = setup(client)
+                    timings[name] = min(timeit.repeat(fn, number=1,
+                                                      repeat=repeat))
+                    out.write('  {:<20} {:>10.4f}s\n'.format(
+                        name, timings[name]))
+                db.session.remove()
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of (size, name, baseline, current) regressions."""
+    regressions = []
+    for size, timings in sorted(results.items()):
+        for name, current in sorted(timings.items()):
+            previous = baseline.get(size, {}).get(name)
+            if previous and current > previous * (1 + tolerance):
+                regressions.append((size, name, previous, current))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the flasktaskr hot paths.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=list(DEFAULT_SIZES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+',
+                        choices=[name for name, _ in BENCHMARKS])
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON to check against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat, args.only)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'created': datetime.utcnow().isoformat(),
+                       'python': platform.python_version(),
+                       'results': results}, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for size, name, previous, current in regressions:
+            print('REGRESSION {} @ {} tasks: {:.4f}s -> {:.4f}s (+{:.0%})'
+                  .format(name, size, previous, current,
+                          current / previous - 1))
+        if regressions:
+            return 1
+        print('no regressions beyond {:.0%}'.format(args.tolerance))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
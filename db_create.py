@@ -2,10 +2,20 @@
 
 
 from project import db
+from project.models import create_task_indexes
+from project.search import create_search_index
+from project.stats import create_task_counts
 
 # create the database and the db table
 db.create_all()
 
+# add the task indexes, search index and counters to a database created
+# before they existed
+with db.engine.begin() as connection:
+    create_task_indexes(connection)
+    create_search_index(connection)
+    create_task_counts(connection)
+
 
 # commit the changes)
 db.session.commit()
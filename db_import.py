@@ -0,0 +1,188 @@
+# db_import.py
+#
+# Load tasks or users from CSV or NDJSON in chunked transactions.
+#
+#   python db_import.py tasks tasks.csv
+#   python db_import.py users users.ndjson --workers 8
+#
+# Each chunk is inserted with one executemany and committed together with
+# a checkpoint row, so an interrupted import resumes where it stopped when
+# run again with the same file.  User passwords are bcrypt-hashed in a
+# process pool.
+
+
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime, date
+
+from sqlalchemy import MetaData, Table, Column, String, Integer
+
+from project import db, bcrypt, task_cache
+from project.models import Task, User
+
+
+checkpoints = Table(
+    'import_checkpoints', MetaData(),
+    Column('source', String, primary_key=True),
+    Column('rows_done', Integer, nullable=False),
+)
+
+
+##########################
+#### helper functions ####
+##########################
+
+def parse_date(value):
+    if isinstance(value, date):
+        return value
+    if not value:
+        # a CSV has '' where the export had NULL
+        return None
+    for fmt in ('%Y-%m-%d', '%m/%d/%Y'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError('unrecognised date: {!r}'.format(value))
+
+
+def task_values(record):
+    status = record.get('status')
+    return {
+        'name': record['name'],
+        'due_date': parse_date(record['due_date']),
+        'priority': int(record['priority']),
+        'posted_date': parse_date(record.get('posted_date')) or
+        date.today(),
+        # 0 (closed) is a real status; only a missing one defaults to open
+        'status': 1 if status in (None, '') else int(status),
+        'user_id': int(record['user_id']) if record.get('user_id') else None,
+    }
+
+
+def user_values(record):
+    return {
+        'name': record['name'],
+        'email': record['email'],
+        'password': record['password'],
+        'role': record.get('role') or 'user',
+    }
+
+
+def hash_password(password):
+    return bcrypt.generate_password_hash(password)
+
+
+def read_records(path):
+    if path.endswith('.csv'):
+        with io.open(path, newline='', encoding='utf-8') as f:
+            lines = f if sys.version_info[0] > 2 else \
+                (line.encode('utf-8') for line in f)
+            for record in csv.DictReader(lines):
+                if sys.version_info[0] == 2:
+                    record = dict((k.decode('utf-8'), v.decode('utf-8'))
+                                  for k, v in record.items())
+                yield record
+    else:
+        with io.open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_checkpoint(connection, source):
+    row = connection.execute(checkpoints.select().where(
+        checkpoints.c.source == source)).first()
+    return row.rows_done if row else 0
+
+
+def set_checkpoint(connection, source, rows_done):
+    updated = connection.execute(checkpoints.update().where(
+        checkpoints.c.source == source).values(rows_done=rows_done))
+    if not updated.rowcount:
+        connection.execute(checkpoints.insert().values(
+            source=source, rows_done=rows_done))
+
+
+def run_import(kind, path, chunk_size=1000, workers=None, restart=False,
+               out=sys.stderr):
+    """Import ``path`` into the ``kind`` table; returns rows inserted."""
+    table = {'tasks': Task.__table__, 'users': User.__table__}[kind]
+    to_values = {'tasks': task_values, 'users': user_values}[kind]
+    source = '{}:{}'.format(kind, os.path.abspath(path))
+
+    checkpoints.create(db.engine, checkfirst=True)
+    with db.engine.begin() as connection:
+        if restart:
+            set_checkpoint(connection, source, 0)
+        done = get_checkpoint(connection, source)
+    if done:
+        out.write('{}: resuming after row {}\n'.format(kind, done))
+
+    pool = multiprocessing.Pool(workers) if kind == 'users' else None
+    records = read_records(path)
+    for _ in range(done):
+        next(records, None)
+
+    inserted = 0
+    start = time.time()
+    try:
+        for chunk in chunks(records, chunk_size):
+            rows = [to_values(record) for record in chunk]
+            if pool is not None:
+                hashes = pool.map(hash_password,
+                                  [row['password'] for row in rows])
+                for row, pw_hash in zip(rows, hashes):
+                    row['password'] = pw_hash
+            with db.engine.begin() as connection:
+                connection.execute(table.insert(), rows)
+                set_checkpoint(connection, source, done + len(rows))
+            done += len(rows)
+            inserted += len(rows)
+            elapsed = time.time() - start
+            out.write('{}: {} rows ({:.0f} rows/s)\n'.format(
+                kind, done, inserted / elapsed if elapsed else 0))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if inserted and kind == 'tasks':
+            # let running app workers drop their cached task lists
+            task_cache.invalidate()
+    return inserted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Import tasks or users from CSV or NDJSON.')
+    parser.add_argument('kind', choices=['tasks', 'users'])
+    parser.add_argument('path', help='.csv, or newline-delimited JSON')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='password hashing processes (default: cores)')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore any saved checkpoint for this file')
+    args = parser.parse_args(argv)
+    run_import(args.kind, args.path, args.chunk_size, args.workers,
+               args.restart)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# db_reconcile.py
+#
+# Check the task_counts table behind /api/v2/stats against the tasks
+# table and rebuild it.
+#
+#   python db_reconcile.py            # report drift, then rebuild
+#   python db_reconcile.py --check    # report only; exit 1 on drift
+#
+# The triggers keep the counts exact, so drift means rows were written
+# with the triggers missing (an older database, a raw bulk load).
+
+
+import argparse
+import sys
+
+from project import db
+from project.stats import reconcile
+
+
+def run_reconcile(repair=True, out=sys.stdout):
+    """Print and return the drift found; rebuild unless ``repair`` is off."""
+    with db.engine.begin() as connection:
+        drift = reconcile(connection, repair=repair)
+    for d in drift:
+        out.write('{}={} status={}: stored {}, actual {}\n'.format(
+            d.dimension, d.key, d.status, d.stored, d.actual))
+    if not drift:
+        out.write('task counts match the tasks table\n')
+    elif repair:
+        out.write('rebuilt task counts ({} rows drifted)\n'.format(
+            len(drift)))
+    return drift
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Reconcile the task counts behind /api/v2/stats.')
+    parser.add_argument('--check', action='store_true',
+                        help='only report drift, exit non-zero if any')
+    args = parser.parse_args(argv)
+    drift = run_reconcile(repair=not args.check)
+    return 1 if drift and args.check else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,6 +21,10 @@ def push():
     local("git push origin {}".format(branch))
 
 
+def assets():
+    local("python -m project.assets")
+
+
 def prepare():
     test()
     commit()
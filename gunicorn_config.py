@@ -0,0 +1,104 @@
+# gunicorn_config.py
+#
+# Production server settings.
+#
+#   gunicorn -c gunicorn_config.py wsgi:app
+#
+# The app is imported once in the master (preload_app) and workers fork
+# from it, sharing its memory copy-on-write and starting instantly.
+#
+# Reloading:
+#   kill -HUP <master>    re-read this file and replace the workers
+#                         gracefully; the preloaded code stays the same
+#   kill -USR2 <master>   start a new master on the new code, then
+#   kill -TERM <old>      once it is serving, to deploy new code with no
+#                         dropped requests
+#
+# Every setting here can be overridden on the command line.
+
+
+import gc
+import glob
+import multiprocessing
+import os
+
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', 8000))
+
+# the usual 2 x cores + 1 workers; WEB_CONCURRENCY (set by Heroku for
+# the dyno size) wins
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             multiprocessing.cpu_count() * 2 + 1))
+# each worker serves requests on a pool of threads (the gthread worker,
+# which 19.3 only knows by its path, and which needs the futures backport
+# on Python 2).  The password hasher sizes its queue from the same
+# GUNICORN_THREADS, as WORKER_THREADS in project/_config.py, so keep the
+# two defaults equal
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS',
+                              'gunicorn.workers.gthread.ThreadWorker')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# seconds an idle client connection is held open (gthread and async
+# workers; sync workers close after each response)
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+
+# recycle workers to cap slow leaks; the jitter keeps them from all
+# restarting at once
+max_requests = 1000
+max_requests_jitter = 100
+
+preload_app = True
+pidfile = os.environ.get('GUNICORN_PIDFILE')
+# the worker heartbeat file is touched constantly; keep it off the disk
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    from project import app, metrics, asset_manifest, load_lazy_blueprints
+    from project.assets import precompress
+    from project.templating import precompile
+
+    # stale snapshots from a previous server would inflate the counters
+    for path in glob.glob(os.path.join(metrics.directory or '',
+                                       'metrics-*.json')):
+        os.remove(path)
+    # fill the template bytecode cache for this deploy; with preload the
+    # workers also inherit the loaded templates
+    precompile(app)
+    # workers fork from this preloaded app; give them the full URL map
+    # rather than have each import the APIs on its first request
+    load_lazy_blueprints(app)
+    # the .gz copies of the static files are built here, not committed;
+    # rescan so the preloaded manifest serves them
+    precompress(app.static_folder)
+    asset_manifest.scan()
+
+
+def pre_fork(server, worker):
+    # collect now so workers do not each copy the pages a first
+    # collection would touch; freeze (3.7+) keeps later ones off them
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    from project import app, db
+
+    # never share a connection pool with the master or a sibling
+    db.get_engine(app).dispose()
+
+
+def child_exit(server, worker):
+    from project import metrics
+
+    # fold the dead worker's counts into the exited total, so recycled
+    # workers don't each leave a file behind
+    metrics.retire(worker.pid)
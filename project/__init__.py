@@ -1,56 +1,234 @@
 # project/__init__.py
 
 
-from flask import Flask, render_template, request, make_response, jsonify
-from flask_sqlalchemy import SQLAlchemy
+import threading
+from functools import partial
+
+from flask import Flask, render_template, request, make_response, jsonify, \
+    current_app, _app_ctx_stack
+from werkzeug.local import LocalProxy
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
 from flask_bcrypt import Bcrypt
-from flask_restful import Api
-import datetime
-
-app = Flask(__name__)
-app.config.from_pyfile('_config.py')
-bcrypt = Bcrypt(app)
-db = SQLAlchemy(app)
-api__v2 = Api(app)
-
-from project.users.views import users_blueprint
-from project.tasks.views import task_blueprint
-from project.api.views import api_blueprint
-from project.api_v2.views import api_v2_blueprint
-
-# register our blueprint
-app.register_blueprint(users_blueprint)
-app.register_blueprint(task_blueprint)
-app.register_blueprint(api_blueprint)
-app.register_blueprint(api_v2_blueprint)
+
+from project.hashing import PasswordHasher, HashingBusy
+from project.errorlog import ErrorLogWriter
+from project.cache import QueryCache
+from project.sqlite import init_sqlite
+from project.instrumentation import init_sql_instrumentation
+from project.metrics import Metrics
+from project.compression import Compressor
+from project.assets import AssetManifest
+from project.templating import init_template_cache
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """Prefer the app in context, falling back to the default app.
+
+    Flask-SQLAlchemy checks ``db.app`` first, which would tie every app
+    made by create_app() to the default app's database.  Functions given
+    to on_engine() run once on each engine an app creates, including the
+    new one it makes when its database URI changes, so event listeners
+    belong to one app's engines rather than to every Engine.
+    """
+
+    def init_app(self, app):
+        super(SQLAlchemy, self).init_app(app)
+        app.extensions['engine_hooks'] = []
+
+    def on_engine(self, app, hook):
+        app.extensions['engine_hooks'].append(hook)
+
+    def get_app(self, reference_app=None):
+        if reference_app is None and _app_ctx_stack.top is not None:
+            return _app_ctx_stack.top.app
+        return super(SQLAlchemy, self).get_app(reference_app)
+
+    def get_engine(self, app, bind=None):
+        engine = super(SQLAlchemy, self).get_engine(app, bind)
+        if not getattr(engine, 'hooks_applied', False):
+            with _hooks_lock:
+                if not getattr(engine, 'hooks_applied', False):
+                    for hook in app.extensions.get('engine_hooks', ()):
+                        hook(engine)
+                    engine.hooks_applied = True
+        return engine
+
+
+_hooks_lock = threading.Lock()
+
+
+def extension(name):
+    """``name`` from the extensions of the app in context, or of the
+    default app outside one."""
+    top = _app_ctx_stack.top
+    return (top.app if top is not None else app).extensions[name]
+
+
+# each app gets its own extension objects from create_app(); these find
+# the current app's
+bcrypt = LocalProxy(partial(extension, 'bcrypt'))
+password_hasher = LocalProxy(partial(extension, 'password_hasher'))
+error_log = LocalProxy(partial(extension, 'error_log'))
+slow_query_log = LocalProxy(partial(extension, 'slow_query_log'))
+task_cache = LocalProxy(partial(extension, 'task_cache'))
+metrics = LocalProxy(partial(extension, 'metrics'))
+asset_manifest = LocalProxy(partial(extension, 'asset_manifest'))
+db = SQLAlchemy()
+
+
+def metrics_blueprint():
+    # flask-restful resources hang off the app, not the api_v2 blueprint
+    api = current_app.extensions.get('api_v2')
+    if request.blueprint is None and api is not None and \
+            request.endpoint in api.endpoints:
+        return 'api_v2'
+    return request.blueprint
+
+
+def init_metrics(app):
+    metrics = Metrics(app, blueprint_of=metrics_blueprint)
+    cache = app.extensions['task_cache']
+    hasher = app.extensions['password_hasher']
+    metrics.add_collector(
+        'flasktaskr_task_cache_hits_total', 'counter',
+        'Task list cache hits.', lambda: cache.stats()['hits'])
+    metrics.add_collector(
+        'flasktaskr_task_cache_misses_total', 'counter',
+        'Task list cache misses.', lambda: cache.stats()['misses'])
+    metrics.add_collector(
+        'flasktaskr_bcrypt_queued', 'gauge',
+        'Password hashes waiting for a worker.',
+        lambda: hasher.stats()['queued'])
+    metrics.add_collector(
+        'flasktaskr_bcrypt_rejected_total', 'counter',
+        'Logins turned away because the hashing queue was full.',
+        lambda: hasher.stats()['rejected'])
+    return metrics
+
+
+##########################
+#### app factory #########
+##########################
+
+def create_app(config=None):
+    """Build and configure an app.
+
+    Settings come from _config.py, then the file named by
+    FLASKTASKR_SETTINGS, then ``config`` (a dict or an object).  With
+    LAZY_API_BLUEPRINTS the api and api_v2 packages, and flask-restful
+    with them, are imported when the app serves its first request, so
+    scripts that only use the models never pay for them.
+    """
+    app = Flask(__name__)
+    app.config.from_pyfile('_config.py')
+    # deployment overrides, e.g. a different database for a load test
+    app.config.from_envvar('FLASKTASKR_SETTINGS', silent=True)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    # before anything loads a template
+    init_template_cache(app)
+    extensions = app.extensions
+    extensions['bcrypt'] = Bcrypt(app)
+    extensions['password_hasher'] = PasswordHasher(extensions['bcrypt'], app)
+    extensions['error_log'] = ErrorLogWriter(app)
+    extensions['slow_query_log'] = ErrorLogWriter(
+        app, path_key='SLOW_QUERY_LOG_PATH')
+    extensions['task_cache'] = QueryCache(app)
+    db.init_app(app)
+    init_sqlite(app, db)
+    init_sql_instrumentation(app, db, extensions['slow_query_log'])
+
+    # the models plus the search index and counters create_all() builds
+    # alongside them
+    from project import models, search, stats
+
+    from project.users.views import users_blueprint
+    from project.tasks.views import task_blueprint
+
+    # register our blueprints
+    app.register_blueprint(users_blueprint)
+    app.register_blueprint(task_blueprint)
+    if app.config['LAZY_API_BLUEPRINTS']:
+        app.wsgi_app = LazyBlueprints(app, register_apis)
+    else:
+        register_apis(app)
+
+    extensions['metrics'] = init_metrics(app)
+    # after_request hooks run last-registered first, so bodies are
+    # compressed before the metrics hook records their size
+    extensions['compressor'] = Compressor(app)
+    extensions['asset_manifest'] = AssetManifest(app)
+    register_error_handlers(app)
+    return app
+
+
+def register_apis(app):
+    from project.api.views import api_blueprint
+    from project.api_v2.views import api_v2_blueprint, api__v2
+
+    app.register_blueprint(api_blueprint)
+    app.register_blueprint(api_v2_blueprint)
+    api__v2.init_app(app)
+    app.extensions['api_v2'] = api__v2
+
+
+class LazyBlueprints(object):
+    """WSGI middleware that runs ``register(app)`` before the first
+    request is routed, so every request sees the complete URL map."""
+
+    def __init__(self, app, register):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self.register = register
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if not self.loaded:
+                self.register(self.app)
+                self.loaded = True
+
+    def __call__(self, environ, start_response):
+        if not self.loaded:
+            self.load()
+        return self.wsgi_app(environ, start_response)
+
+
+def load_lazy_blueprints(app):
+    """Register anything LAZY_API_BLUEPRINTS deferred, now."""
+    if isinstance(app.wsgi_app, LazyBlueprints):
+        app.wsgi_app.load()
+
+
+##########################
+#### error handlers ######
+##########################
 
 def write_to_error_log(url, error):
-    now = datetime.datetime.now()
-    r = url
-    with open('error.log', 'a') as f:
-        current_timestamp = now.strftime("%d-%m-%Y %H:%M:%S")
-        f.write("\n{} error at {}: {}".format(error, current_timestamp, r))
+    error_log.write(url, error)
 
 
-@app.errorhandler(404)
 def not_found(error):
-    if app.debug is not True:
+    if current_app.debug is not True:
         write_to_error_log(request.url, error)
 
     return render_template('404.html'), 404
 
-@app.errorhandler(500)
+
 def internal_error(error):
     db.session.rollback()
-    if app.debug is not True:
+    if current_app.debug is not True:
         write_to_error_log(request.url, error)
 
     return render_template('500.html'), 500
 
 
-@app.errorhandler(405)
 def method_not_allowed_error(error):
-    if app.debug is not True:
+    if current_app.debug is not True:
         write_to_error_log(request.url, error)
 
     result = {'status': 'error',
@@ -58,9 +236,18 @@ def method_not_allowed_error(error):
     code = 405
     return make_response(jsonify(result), code)
 
-@app.errorhandler(401)
+
+def hashing_busy_error(error):
+    result = {'status': 'error',
+              'error description': 'server busy, try again shortly'}
+    code = 503
+    response = make_response(jsonify(result), code)
+    response.headers['Retry-After'] = '1'
+    return response
+
+
 def unauthorized_error(error):
-    if app.debug is not True:
+    if current_app.debug is not True:
         write_to_error_log(request.url, error)
 
     result = {'status': 'error',
@@ -69,4 +256,15 @@ def unauthorized_error(error):
     return make_response(jsonify(result), code)
 
 
+def register_error_handlers(app):
+    app.register_error_handler(404, not_found)
+    app.register_error_handler(500, internal_error)
+    app.register_error_handler(405, method_not_allowed_error)
+    app.register_error_handler(HashingBusy, hashing_busy_error)
+    app.register_error_handler(401, unauthorized_error)
+
 
+# the default app; scripts and tests use it, and db falls back to it
+# outside an app context
+app = create_app()
+db.app = app
@@ -11,5 +11,89 @@ DATABASE_PATH = os.path.join(basedir, DATABASE)
 
 SQLALCHEMY_DATABASE_URI = 'sqlite:///' + DATABASE_PATH
 
+# applied to every new SQLite connection (see project/sqlite.py); WAL
+# lets readers run alongside a writer and busy_timeout makes a blocked
+# writer wait instead of failing with "database is locked"
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -16000,
+    'mmap_size': 268435456,
+}
+
 DEBUG = False
 
+# keyset pagination for the task list endpoints
+API_PAGE_SIZE = 10
+API_MAX_PAGE_SIZE = 100
+
+# /tasks/ lists search matches and open and closed tasks a page at a
+# time; ?per_page= can ask for up to TASKS_MAX_PAGE_SIZE rows per section
+TASKS_PAGE_SIZE = 25
+TASKS_MAX_PAGE_SIZE = 100
+
+# largest number of operations accepted by /api/v2/tasks/bulk
+API_BULK_MAX_ITEMS = 10000
+
+# lifetime in seconds of tokens issued by /api/v2/token
+API_TOKEN_EXPIRATION = 3600
+
+# request threads in each gunicorn worker; gunicorn_config.py reads the
+# same variable, and the password hasher is sized from it
+WORKER_THREADS = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# bcrypt runs on this many threads per process; once BCRYPT_QUEUE_SIZE
+# requests are waiting, logins are answered 503 instead of queued.  None
+# sizes the queue so logins hold at most half of WORKER_THREADS, leaving
+# the rest free for everything else
+BCRYPT_WORKERS = 2
+BCRYPT_QUEUE_SIZE = None
+
+# error.log is written from a background thread; lines beyond the queue
+# size are dropped, and the file rotates after ERROR_LOG_MAX_BYTES
+ERROR_LOG_PATH = 'error.log'
+ERROR_LOG_MAX_BYTES = 1024 * 1024
+ERROR_LOG_BACKUP_COUNT = 3
+ERROR_LOG_QUEUE_SIZE = 1000
+
+# open/closed task lists are cached per worker; writes invalidate them
+# and touch TASK_CACHE_STAMP so the other workers drop theirs too
+TASK_CACHE_SIZE = 64
+TASK_CACHE_TTL = 30
+TASK_CACHE_STAMP = os.path.join(basedir, 'task_cache.stamp')
+
+# per-request query count and DB time go out as a Server-Timing header;
+# statements slower than the threshold are written to the slow query log
+SQL_INSTRUMENTATION = True
+SLOW_QUERY_THRESHOLD_MS = 100
+SLOW_QUERY_LOG_PATH = 'slow_query.log'
+
+# each worker writes its request metrics here; /metrics sums the files
+METRICS_DIR = os.environ.get('METRICS_DIR',
+                             os.path.join(basedir, 'metrics'))
+# seconds between a worker's background writes of its file
+METRICS_FLUSH_INTERVAL = 1.0
+
+# response compression: which mimetypes, the smallest buffered body worth
+# compressing (streamed bodies always are), and the zlib (1-9) and brotli
+# (0-11) levels; brotli is only offered when the module is installed
+COMPRESS_MIMETYPES = ['text/html', 'text/css', 'text/csv', 'text/plain',
+                      'application/json', 'application/x-ndjson',
+                      'application/javascript']
+COMPRESS_MIN_SIZE = 500
+COMPRESS_LEVEL = 6
+COMPRESS_BR_LEVEL = 4
+
+# compiled templates are kept here and shared by the workers on a host;
+# set to '' to compile from source in every process
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR',
+                                    os.path.join(basedir, 'template_cache'))
+
+# fingerprinted /assets/ URLs never change content, so cache them a year
+ASSETS_MAX_AGE = 365 * 24 * 60 * 60
+
+# import the api and api_v2 blueprints when the app serves its first
+# request rather than when it is created; for scripts and workers that
+# don't preload
+LAZY_API_BLUEPRINTS = False
@@ -8,6 +8,8 @@ from flask_restful import reqparse
 
 from project import db
 from project.models import Task
+from project.pagination import paginate, page_url, InvalidCursor
+from project.serializers import task_query, task_to_dict
 
 
 ################
@@ -51,34 +53,23 @@ parser.add_argument('task', type=str)
 
 @api_blueprint.route('/api/v1/tasks/')
 def api_tasks():
-    results = db.session.query(Task).limit(10).offset(0).all()
-    json_results = []
-    for result in results:
-        data = {
-            'task_id': result.task_id,
-            'task_name': result.name,
-            'due_date': str(result.due_date),
-            'priority': result.priority,
-            'posted date': str(result.posted_date),
-            'status': result.status,
-            'user id': result.user_id
-        }
-        json_results.append(data)
-    return jsonify(items=json_results)
+    try:
+        page = paginate(task_query(), [Task.task_id],
+                        cursor=request.args.get('cursor'),
+                        limit=request.args.get('limit', type=int))
+    except InvalidCursor:
+        result = {"error": "Invalid cursor"}
+        return make_response(jsonify(result), 400)
+    json_results = [task_to_dict(row) for row in page.items]
+    return jsonify(items=json_results,
+                   next=page_url(page.next_cursor),
+                   prev=page_url(page.prev_cursor))
 
 @api_blueprint.route('/api/v1/tasks/<int:task_id>')
 def task(task_id):
-    result = db.session.query(Task).filter_by(task_id=task_id).first()
+    result = task_query().filter(Task.task_id == task_id).first()
     if result:
-        result = {
-            'task_id': result.task_id,
-            'task_name': result.name,
-            'due_date': str(result.due_date),
-            'priority': result.priority,
-            'posted date': str(result.posted_date),
-            'status': result.status,
-            'user id': result.user_id
-        }
+        result = task_to_dict(result)
         code = 200
     else:
         result = {"error": "Element does not exist"}
@@ -2,14 +2,27 @@
 
 
 from functools import wraps
-from flask import flash, redirect, session, url_for, Blueprint, g
-from flask_restful import reqparse, Resource
+from flask import flash, redirect, session, url_for, Blueprint, g, \
+    request, current_app, Response, stream_with_context
+from flask_restful import Api, reqparse, Resource
 from flask_httpauth import HTTPBasicAuth
+from sqlalchemy import bindparam
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from six import string_types, text_type, PY2
 
-from project import db, api__v2, bcrypt
+from project import db, password_hasher, task_cache
 from project.models import Task, User
+from project.pagination import paginate, page_url, page_size, \
+    InvalidCursor
+from project.search import search_tasks
+from project.stats import task_stats
+from project.serializers import task_query, task_to_dict
 
-from datetime import datetime
+from datetime import date, datetime
+import csv
+import io
+import json
 
 
 ################
@@ -18,6 +31,8 @@ from datetime import datetime
 
 api_v2_blueprint = Blueprint('api_v2', __name__)
 
+api__v2 = Api()
+
 auth = HTTPBasicAuth()
 
 ##########################
@@ -46,10 +61,178 @@ def closed_tasks():
         status='0').order_by(Task.due_date.asc())
 
 
+# sort name -> (keyset columns, descending)
+TASK_SORTS = {
+    'task_id': ([Task.task_id], False),
+    '-task_id': ([Task.task_id], True),
+    'due_date': ([Task.due_date, Task.task_id], False),
+    '-due_date': ([Task.due_date, Task.task_id], True),
+}
+
+
+def api_date(value):
+    return datetime.strptime(value, '%m/%d/%Y').date()
+
+
+class unindexed(FunctionElement):
+    """A column's value that SQLite will not look up through an index."""
+    name = 'unindexed'
+
+    def __init__(self, column):
+        FunctionElement.__init__(self, column)
+        self.type = column.type
+
+
+@compiles(unindexed)
+def _compile_unindexed(element, compiler, **kw):
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(unindexed, 'sqlite')
+def _compile_unindexed_sqlite(element, compiler, **kw):
+    # a unary + is SQLite's documented way to keep a term off the indexes
+    return '+' + compiler.process(element.clauses, **kw)
+
+
+def filter_tasks(query, args, columns):
+    """Apply the list filters for a page sorted on ``columns``.
+
+    A range filter on anything but the leading sort column can't be read
+    from an index in sort order, and an index on it would leave SQLite
+    sorting every match for each page.  Those ranges are checked row by
+    row instead, while the page walks the sort order and stops at the
+    limit.
+    """
+    def ranged(column):
+        return column if column is columns[0] else unindexed(column)
+
+    if args['status'] is not None:
+        query = query.filter(Task.status == args['status'])
+    if args['user_id'] is not None:
+        query = query.filter(Task.user_id == args['user_id'])
+    if args['priority_min'] is not None:
+        query = query.filter(ranged(Task.priority) >= args['priority_min'])
+    if args['priority_max'] is not None:
+        query = query.filter(ranged(Task.priority) <= args['priority_max'])
+    if args['due_after'] is not None:
+        query = query.filter(ranged(Task.due_date) >= args['due_after'])
+    if args['due_before'] is not None:
+        query = query.filter(ranged(Task.due_date) <= args['due_before'])
+    return query
+
+
+def bulk_task_values(item):
+    """Validate one bulk create/update item the way post_parser would."""
+    if not isinstance(item, dict):
+        raise ValueError('item must be an object')
+    name = item.get('name')
+    if not name or not isinstance(name, string_types):
+        raise ValueError('name is required')
+    try:
+        due_date = datetime.strptime(item.get('due_date'), '%m/%d/%Y').date()
+    except (TypeError, ValueError):
+        raise ValueError('due_date must be mm/dd/yyyy')
+    try:
+        priority = int(item.get('priority'))
+    except (TypeError, ValueError):
+        raise ValueError('priority must be an integer')
+    return {'name': name, 'due_date': due_date, 'priority': priority,
+            'posted_date': datetime.utcnow()}
+
+
+def bulk_task_id(item):
+    try:
+        return int(item['task_id'] if isinstance(item, dict) else item)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('task_id must be an integer')
+
+
+# the columns db_import.py reads, so an export loads straight back in;
+# in task_query() order
+EXPORT_FIELDS = ('task_id', 'name', 'due_date', 'priority', 'posted_date',
+                 'status', 'user_id')
+EXPORT_CHUNK_ROWS = 500
+
+
+def _csv_line(values):
+    buf = io.BytesIO() if PY2 else io.StringIO()
+    if PY2:
+        values = [v.encode('utf-8') if isinstance(v, text_type) else v
+                  for v in values]
+    csv.writer(buf).writerow(values)
+    return buf.getvalue()
+
+
+def export_values(row):
+    return [v.isoformat() if isinstance(v, date) else v for v in row]
+
+
+def export_rows(fmt):
+    """Yield the whole task table as NDJSON or CSV, a chunk at a time.
+
+    Rows come off the cursor in yield_per batches and are written out as
+    they arrive, so memory use does not depend on the table size.  The
+    first row goes out on its own so the download starts at once.
+    """
+    if fmt == 'csv':
+        yield _csv_line(EXPORT_FIELDS)
+    chunk, size = [], 1
+    rows = task_query().order_by(Task.task_id).yield_per(EXPORT_CHUNK_ROWS)
+    for row in rows:
+        values = export_values(row)
+        if fmt == 'csv':
+            chunk.append(_csv_line(values))
+        else:
+            chunk.append(json.dumps(dict(zip(EXPORT_FIELDS, values))) + '\n')
+        if len(chunk) >= size:
+            yield ''.join(chunk)
+            chunk, size = [], EXPORT_CHUNK_ROWS
+    if chunk:
+        yield ''.join(chunk)
+
+
+def link_header(page):
+    links = []
+    for rel, cursor in (('next', page.next_cursor),
+                        ('prev', page.prev_cursor)):
+        if cursor is not None:
+            links.append('<{}>; rel="{}"'.format(page_url(cursor), rel))
+    return {'Link': ', '.join(links)} if links else {}
+
+
+def search_link_header(page, has_next):
+    args = request.args.to_dict()
+    links = []
+    for rel, number in (('next', page + 1 if has_next else None),
+                        ('prev', page - 1 if page > 1 else None)):
+        if number is not None:
+            args['page'] = number
+            links.append('<{}>; rel="{}"'.format(
+                url_for(request.endpoint, **args), rel))
+    return {'Link': ', '.join(links)} if links else {}
+
+
 @auth.verify_password
-def verify_password(username, password):
-    user = User.query.filter_by(name=username).first()
-    if user is not None and bcrypt.check_password_hash(
+def verify_password(username_or_token, password):
+    # a signed token is checked with one HMAC and a primary key lookup;
+    # bcrypt only runs when real credentials are presented
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        token = header[len('Bearer '):]
+    elif username_or_token and not password:
+        token = username_or_token
+    else:
+        token = None
+    if token is not None:
+        g.token_auth = True
+        user = User.verify_auth_token(token)
+        if user is None:
+            return False
+        g.user = user
+        return True
+
+    user = User.query.filter_by(name=username_or_token).first()
+    if user is not None and password_hasher.check_password_hash(
             user.password, password):
         g.user = user
         return True
@@ -67,22 +250,34 @@ class ApiTaskList(Resource):
         self.post_parser.add_argument('name', type=str, location='json')
         self.post_parser.add_argument('due_date', type=str, location='json')
         self.post_parser.add_argument('priority', type=int, location='json')
+        self.get_parser = reqparse.RequestParser()
+        self.get_parser.add_argument('cursor', type=str, location='args')
+        self.get_parser.add_argument('limit', type=int, location='args')
+        self.get_parser.add_argument('status', type=int, location='args')
+        self.get_parser.add_argument('priority_min', type=int,
+                                     location='args')
+        self.get_parser.add_argument('priority_max', type=int,
+                                     location='args')
+        self.get_parser.add_argument('due_after', type=api_date,
+                                     location='args')
+        self.get_parser.add_argument('due_before', type=api_date,
+                                     location='args')
+        self.get_parser.add_argument('user_id', type=int, location='args')
+        self.get_parser.add_argument('sort', type=str, location='args',
+                                     default='task_id',
+                                     choices=list(TASK_SORTS))
 
     def get(self):
-        results = db.session.query(Task).limit(10).offset(0).all()
-        json_results = []
-        for result in results:
-            data = {
-                'task_id': result.task_id,
-                'task_name': result.name,
-                'due_date': str(result.due_date),
-                'priority': result.priority,
-                'posted date': str(result.posted_date),
-                'status': result.status,
-                'user id': result.user_id
-            }
-            json_results.append(data)
-        return json_results
+        args = self.get_parser.parse_args()
+        columns, descending = TASK_SORTS[args['sort']]
+        try:
+            page = paginate(filter_tasks(task_query(), args, columns),
+                            columns, cursor=args['cursor'],
+                            limit=args['limit'], descending=descending)
+        except InvalidCursor:
+            return {"error": "Invalid cursor"}, 400
+        json_results = [task_to_dict(row) for row in page.items]
+        return json_results, 200, link_header(page)
 
     @auth.login_required
     def post(self):
@@ -97,6 +292,7 @@ class ApiTaskList(Resource):
         )
         db.session.add(new_task)
         db.session.commit()
+        task_cache.invalidate()
         result = {"status": "Entry was successfully posted",
                   "task added": args['name']}
         code = 201
@@ -111,17 +307,9 @@ class ApiTask(Resource):
         self.post_parser.add_argument('priority', type=int, location='json')
 
     def get(self, task_id):
-        result = db.session.query(Task).filter_by(task_id=task_id).first()
+        result = task_query().filter(Task.task_id == task_id).first()
         if result:
-            result = {
-                'task_id': result.task_id,
-                'task_name': result.name,
-                'due_date': str(result.due_date),
-                'priority': result.priority,
-                'posted date': str(result.posted_date),
-                'status': result.status,
-                'user id': result.user_id
-            }
+            result = task_to_dict(result)
             code = 200
         else:
             result = {"error": "Element does not exist"}
@@ -143,6 +331,7 @@ class ApiTask(Resource):
             }
             task.update(updated_task)
             db.session.commit()
+            task_cache.invalidate()
             code = 201
             result = {"status": "task updated successfully"}
         else:
@@ -158,6 +347,7 @@ class ApiTask(Resource):
         if task:
             task.delete()
             db.session.commit()
+            task_cache.invalidate()
             code = 201
             result = {"status": "task deleted"}
         else:
@@ -167,9 +357,162 @@ class ApiTask(Resource):
         return result, code
 
 
+class ApiTaskBulk(Resource):
+    """Apply many creates, updates and deletes in a single transaction.
+
+    The body is ``{"create": [...], "update": [...], "delete": [...]}``.
+    Each list is validated item by item; the valid items of each kind go
+    to the database as one executemany statement and the whole batch is
+    committed once.  The response reports a status for every item.
+    """
+
+    @auth.login_required
+    def post(self):
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return {"error": "Expected a JSON object"}, 400
+        batches = dict((kind, body.get(kind) or [])
+                       for kind in ('create', 'update', 'delete'))
+        if any(not isinstance(items, list) for items in batches.values()):
+            return {"error": "create, update and delete must be lists"}, 400
+        total = sum(len(items) for items in batches.values())
+        if total > current_app.config['API_BULK_MAX_ITEMS']:
+            return {"error": "Too many items in one request"}, 413
+
+        results = dict((kind, []) for kind in batches)
+        inserts, updates, deletes = [], [], []
+
+        for index, item in enumerate(batches['create']):
+            try:
+                values = bulk_task_values(item)
+            except ValueError as e:
+                results['create'].append(
+                    {"index": index, "status": 400, "error": str(e)})
+                continue
+            values.update(status='1', user_id=g.user.id)
+            inserts.append(values)
+            results['create'].append({"index": index, "status": 201})
+
+        pending = []
+        for kind in ('update', 'delete'):
+            for index, item in enumerate(batches[kind]):
+                try:
+                    task_id = bulk_task_id(item)
+                    values = bulk_task_values(item) if kind == 'update' \
+                        else None
+                except ValueError as e:
+                    results[kind].append(
+                        {"index": index, "status": 400, "error": str(e)})
+                    continue
+                pending.append((kind, index, task_id, values))
+
+        wanted = set(task_id for _, _, task_id, _ in pending)
+        existing = set()
+        if wanted:
+            existing = set(row[0] for row in db.session.query(
+                Task.task_id).filter(Task.task_id.in_(wanted)))
+
+        for kind, index, task_id, values in pending:
+            if task_id not in existing:
+                results[kind].append({"index": index, "task_id": task_id,
+                                      "status": 404,
+                                      "error": "Element does not exist"})
+                continue
+            if kind == 'update':
+                values['b_task_id'] = task_id
+                updates.append(values)
+            else:
+                deletes.append(task_id)
+            results[kind].append(
+                {"index": index, "task_id": task_id, "status": 200})
+
+        tasks = Task.__table__
+        if inserts:
+            db.session.execute(tasks.insert(), inserts)
+        if updates:
+            db.session.execute(
+                tasks.update().where(
+                    tasks.c.task_id == bindparam('b_task_id')),
+                updates)
+        if deletes:
+            db.session.execute(
+                tasks.delete().where(tasks.c.task_id.in_(deletes)))
+        db.session.commit()
+        task_cache.invalidate()
+
+        for kind in results:
+            results[kind].sort(key=lambda r: r['index'])
+        result = {"status": "bulk request processed",
+                  "created": len(inserts), "updated": len(updates),
+                  "deleted": len(deletes), "results": results}
+        return result, 200
+
+
+class ApiTaskSearch(Resource):
+    """Tasks whose names match ``q``, best bm25 rank first.
+
+    Pages are numbered; ``page`` and ``limit`` work like the list's
+    ``limit``.
+    """
+
+    def __init__(self):
+        self.get_parser = reqparse.RequestParser()
+        self.get_parser.add_argument('q', type=text_type, location='args')
+        self.get_parser.add_argument('page', type=int, location='args',
+                                     default=1)
+        self.get_parser.add_argument('limit', type=int, location='args')
+
+    def get(self):
+        args = self.get_parser.parse_args()
+        if not args['q'] or not args['q'].strip():
+            return {"error": "q is required"}, 400
+        if args['page'] < 1:
+            return {"error": "page must be 1 or more"}, 400
+        limit = page_size(args['limit'])
+        rows = search_tasks(args['q'], limit + 1,
+                            (args['page'] - 1) * limit)
+        json_results = [task_to_dict(tuple(row)[:7]) for row in rows[:limit]]
+        return json_results, 200, search_link_header(
+            args['page'], len(rows) > limit)
+
+
+class ApiTaskExport(Resource):
+    mimetypes = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def get(self):
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in self.mimetypes:
+            return {"error": "format must be ndjson or csv"}, 400
+        response = Response(stream_with_context(export_rows(fmt)),
+                            mimetype=self.mimetypes[fmt])
+        response.headers['Content-Disposition'] = \
+            'attachment; filename=tasks.{}'.format(fmt)
+        return response
+
+
+class ApiStats(Resource):
+    def get(self):
+        return task_stats(), 200
+
+
+class ApiToken(Resource):
+    @auth.login_required
+    def post(self):
+        if g.get('token_auth'):
+            return {"error": "A password is required to issue a token"}, 401
+        expiration = current_app.config['API_TOKEN_EXPIRATION']
+        token = g.user.generate_auth_token(expiration)
+        return {"token": token.decode('ascii'), "expires_in": expiration}, 201
+
+
 ################
 # routes       #
 ################
 
 api__v2.add_resource(ApiTaskList, '/api/v2/tasks/')
 api__v2.add_resource(ApiTask, '/api/v2/tasks/<int:task_id>')
+api__v2.add_resource(ApiTaskBulk, '/api/v2/tasks/bulk')
+api__v2.add_resource(ApiTaskSearch, '/api/v2/tasks/search')
+api__v2.add_resource(ApiTaskExport, '/api/v2/tasks/export')
+api__v2.add_resource(ApiStats, '/api/v2/stats')
+api__v2.add_resource(ApiToken, '/api/v2/token')
@@ -0,0 +1,130 @@
+# project/assets.py
+
+
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import abort, request, send_file, url_for
+
+
+def fingerprint(data):
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+def fingerprinted_name(filename, digest):
+    root, ext = os.path.splitext(filename)
+    return '{}.{}{}'.format(root, digest, ext)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _gunzip(path):
+    f = gzip.open(path, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+class AssetManifest(object):
+    """Content-hashed URLs for the files under the static folder.
+
+    Every file is hashed once at startup; ``asset_url('css/main.css')``
+    in a template gives ``/assets/css/main.<hash>.css``, which is served
+    with a one-year immutable Cache-Control since a new version of the
+    file gets a new URL.  A ``.gz`` file next to an asset is sent to
+    clients that accept gzip, but only if it decompresses to the current
+    contents, so a stale one is ignored rather than served.
+    """
+
+    def __init__(self, app=None):
+        self.assets = {}
+        self.files = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.root = app.static_folder
+        self.max_age = app.config['ASSETS_MAX_AGE']
+        self.scan()
+        app.jinja_env.globals['asset_url'] = self.url
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.view)
+
+    def scan(self):
+        self.assets, self.files = {}, {}
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith('.gz'):
+                    path = os.path.join(directory, name)
+                    self.add(os.path.relpath(path, self.root)
+                             .replace(os.sep, '/'))
+
+    def add(self, filename):
+        path = os.path.join(self.root, filename)
+        data = _read(path)
+        name = fingerprinted_name(filename, fingerprint(data))
+        gz_path = path + '.gz'
+        if not os.path.isfile(gz_path) or _gunzip(gz_path) != data:
+            gz_path = None
+        self.assets[filename] = name
+        self.files[name] = (path, gz_path)
+        return name
+
+    def url(self, filename):
+        # in debug the file may have been edited since startup
+        if self.app.debug and filename in self.assets:
+            self.add(filename)
+        name = self.assets.get(filename)
+        if name is None:
+            return url_for('static', filename=filename)
+        return url_for('assets', filename=name)
+
+    def view(self, filename):
+        if filename not in self.files:
+            abort(404)
+        path, gz_path = self.files[filename]
+        mimetype = mimetypes.guess_type(path)[0] or \
+            'application/octet-stream'
+        if gz_path is not None and request.accept_encodings['gzip']:
+            response = send_file(gz_path, mimetype=mimetype,
+                                 cache_timeout=self.max_age,
+                                 conditional=True)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_file(path, mimetype=mimetype,
+                                 cache_timeout=self.max_age,
+                                 conditional=True)
+        if gz_path is not None:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = \
+            'public, max-age={}, immutable'.format(self.max_age)
+        return response
+
+
+def precompress(root, level=9):
+    """Write a ``.gz`` next to every css and js file under ``root``."""
+    written = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if os.path.splitext(name)[1] not in ('.css', '.js'):
+                continue
+            path = os.path.join(directory, name)
+            f = gzip.GzipFile(path + '.gz', 'wb', level, mtime=0)
+            try:
+                f.write(_read(path))
+            finally:
+                f.close()
+            written.append(path + '.gz')
+    return written
+
+
+if __name__ == '__main__':
+    from project import app
+    for path in precompress(app.static_folder):
+        print(path)
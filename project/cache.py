@@ -0,0 +1,83 @@
+# project/cache.py
+
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache(object):
+    """Small LRU cache with a TTL for query results that must be fresh.
+
+    Views that change the cached data call ``invalidate()`` after they
+    commit.  Each gunicorn worker holds its own entries, so invalidation
+    also bumps the mtime of a shared stamp file; an entry filled before
+    the latest stamp is treated as a miss in every process.
+    """
+
+    def __init__(self, app=None, maxsize=64, ttl=30, stamp_path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stamp_path = stamp_path
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config['TASK_CACHE_SIZE']
+        self.ttl = app.config['TASK_CACHE_TTL']
+        self.stamp_path = app.config['TASK_CACHE_STAMP']
+
+    def _stamp(self):
+        if not self.stamp_path:
+            return None
+        try:
+            return os.stat(self.stamp_path).st_mtime
+        except OSError:
+            return None
+
+    def get_or_set(self, key, fill):
+        now = time.time()
+        stamp = self._stamp()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, entry_stamp, value = entry
+                if expires > now and entry_stamp == stamp:
+                    self._entries[key] = self._entries.pop(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            generation = self.invalidations
+        value = fill()
+        with self._lock:
+            # a write that committed while we were filling wins
+            if generation == self.invalidations:
+                self._entries[key] = (now + self.ttl, stamp, value)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+        if self.stamp_path:
+            with open(self.stamp_path, 'a'):
+                os.utime(self.stamp_path, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'invalidations': self.invalidations,
+                    'size': len(self._entries)}
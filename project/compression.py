@@ -0,0 +1,124 @@
+# project/compression.py
+
+
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _gzip_compressor(level):
+    # wbits 16 + MAX_WBITS writes a gzip header and trailer
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+class _Gzip(object):
+    def __init__(self, level):
+        self.compressor = _gzip_compressor(level)
+
+    def chunk(self, data):
+        # a sync flush per chunk lets the client decode what it has so far
+        return self.compressor.compress(data) + \
+            self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class _Brotli(object):
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def chunk(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+def compress(encoding, level, data):
+    """Compress a whole body with ``encoding`` ('gzip' or 'br')."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    compressor = _gzip_compressor(level)
+    return compressor.compress(data) + compressor.flush()
+
+
+class Compressor(object):
+    """Gzip (and Brotli, when the module is installed) response bodies.
+
+    Only responses whose mimetype is in ``COMPRESS_MIMETYPES`` are
+    considered; those always get ``Vary: Accept-Encoding`` so caches
+    keep the variants apart.  Buffered bodies under ``COMPRESS_MIN_SIZE``
+    are sent as they are.  Streamed bodies are compressed chunk by chunk
+    as the generator yields, without buffering the whole response.
+    """
+
+    def __init__(self, app=None):
+        self.mimetypes = set()
+        self.min_size = 0
+        self.levels = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.mimetypes = set(app.config['COMPRESS_MIMETYPES'])
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.levels = {'gzip': app.config['COMPRESS_LEVEL']}
+        if brotli is not None:
+            self.levels['br'] = app.config['COMPRESS_BR_LEVEL']
+        app.after_request(self.after_request)
+
+    def choose_encoding(self):
+        """The acceptable encoding with the highest q, preferring br."""
+        accepted = request.accept_encodings
+        best, best_quality = None, 0
+        for encoding in ('br', 'gzip'):
+            if encoding not in self.levels:
+                continue
+            quality = accepted[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def after_request(self, response):
+        if response.mimetype not in self.mimetypes:
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.status_code < 200 or response.status_code in (204, 304) \
+                or response.direct_passthrough \
+                or 'Content-Encoding' in response.headers:
+            return response
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+        level = self.levels[encoding]
+
+        if response.is_streamed:
+            response.response = self._stream(
+                response.response, encoding, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(compress(encoding, level, data))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def _stream(self, body, encoding, level):
+        compressor = _Brotli(level) if encoding == 'br' else _Gzip(level)
+        try:
+            for data in body:
+                if not isinstance(data, bytes):
+                    data = data.encode('utf-8')
+                if data:
+                    yield compressor.chunk(data)
+            yield compressor.finish()
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
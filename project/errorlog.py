@@ -0,0 +1,123 @@
+# project/errorlog.py
+
+
+import atexit
+import datetime
+import os
+import threading
+
+try:
+    from Queue import Queue, Full, Empty
+except ImportError:
+    from queue import Queue, Full, Empty
+
+
+class ErrorLogWriter(object):
+    """Append error lines to a log file from a background thread.
+
+    Request threads only put a line on a bounded queue; the writer thread
+    drains whatever has accumulated, writes it with a single open and
+    write, and rotates the file once it grows past ``max_bytes``.  When
+    the queue is full new lines are dropped and counted rather than
+    blocking the request.  Anything still queued is written at exit.
+    """
+
+    def __init__(self, app=None, path='error.log', max_bytes=1024 * 1024,
+                 backup_count=3, queue_size=1000, batch_size=500,
+                 path_key='ERROR_LOG_PATH'):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        if app is not None:
+            self.init_app(app, path_key)
+
+    def init_app(self, app, path_key='ERROR_LOG_PATH'):
+        self.path = app.config[path_key]
+        self.max_bytes = app.config['ERROR_LOG_MAX_BYTES']
+        self.backup_count = app.config['ERROR_LOG_BACKUP_COUNT']
+        self.queue_size = app.config['ERROR_LOG_QUEUE_SIZE']
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = Queue(maxsize=max(self.queue_size, 1))
+            self._thread = threading.Thread(target=self._work)
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.close)
+
+    def write(self, url, error):
+        now = datetime.datetime.now()
+        current_timestamp = now.strftime("%d-%m-%Y %H:%M:%S")
+        self.write_line(
+            "\n{} error at {}: {}".format(error, current_timestamp, url))
+
+    def write_line(self, line):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(line)
+        except Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _work(self):
+        queue = self._queue
+        while True:
+            # block for the first line, then take whatever piled up while
+            # the previous batch was being written
+            lines = [queue.get()]
+            try:
+                while len(lines) < self.batch_size:
+                    lines.append(queue.get_nowait())
+            except Empty:
+                pass
+            batch = [line for line in lines if line is not None]
+            try:
+                if batch:
+                    self._write_batch(batch)
+            except (IOError, OSError):
+                with self._lock:
+                    self.dropped += len(batch)
+            finally:
+                for _ in lines:
+                    queue.task_done()
+            if len(batch) != len(lines):
+                return
+
+    def _write_batch(self, lines):
+        with open(self.path, 'a') as f:
+            f.write(''.join(lines))
+            size = f.tell()
+        if self.max_bytes and size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            source = '{}.{}'.format(self.path, i)
+            if os.path.exists(source):
+                os.rename(source, '{}.{}'.format(self.path, i + 1))
+        if self.backup_count > 0:
+            os.rename(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+    def flush(self):
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        if self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._pid = None
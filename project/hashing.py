@@ -0,0 +1,114 @@
+# project/hashing.py
+
+
+import os
+import threading
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class _Job(object):
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PasswordHasher(object):
+    """Run bcrypt on a fixed pool of worker threads.
+
+    At most ``workers`` hashes run at once and at most ``queue_size``
+    more wait for a worker; anything beyond that raises HashingBusy
+    straight away so the caller can answer 503 instead of tying up
+    another request thread.  Workers are started on first use in each
+    process, so the pool survives a pre-fork server.
+    """
+
+    def __init__(self, bcrypt, app=None, workers=4, queue_size=32):
+        self.bcrypt = bcrypt
+        self.workers = workers
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.workers = app.config['BCRYPT_WORKERS']
+        self.queue_size = app.config['BCRYPT_QUEUE_SIZE']
+        if self.queue_size is None:
+            self.queue_size = max(
+                app.config['WORKER_THREADS'] // 2 - self.workers, 1)
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = Queue(maxsize=max(self.queue_size, 1))
+            self._in_flight = 0
+            for _ in range(self.workers):
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+            self._pid = os.getpid()
+
+    def _work(self):
+        queue = self._queue
+        while True:
+            job = queue.get()
+            with self._lock:
+                self._in_flight += 1
+            try:
+                job.result = job.fn(*job.args)
+            except Exception as e:
+                job.error = e
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._completed += 1
+                job.done.set()
+
+    def submit(self, fn, *args):
+        if self._pid != os.getpid():
+            self._start()
+        job = _Job(fn, args)
+        try:
+            self._queue.put_nowait(job)
+        except Full:
+            with self._lock:
+                self._rejected += 1
+            raise HashingBusy()
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def check_password_hash(self, pw_hash, password):
+        return self.submit(self.bcrypt.check_password_hash, pw_hash, password)
+
+    def generate_password_hash(self, password):
+        return self.submit(self.bcrypt.generate_password_hash, password)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'queued': self._queue.qsize() if self._queue else 0,
+                'in_flight': self._in_flight,
+                'completed': self._completed,
+                'rejected': self._rejected,
+            }
@@ -0,0 +1,72 @@
+# project/instrumentation.py
+
+
+import datetime
+import re
+import time
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAM_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(statement):
+    """Collapse a statement to its shape so slow queries group together."""
+    statement = _LITERALS.sub('?', statement)
+    statement = _PARAM_LISTS.sub('(?, ...)', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+
+def init_sql_instrumentation(app, db, slow_log):
+    """Count and time the SQL each request of ``app`` issues.
+
+    The totals go out in a Server-Timing header; any single statement
+    slower than SLOW_QUERY_THRESHOLD_MS is handed to ``slow_log`` along
+    with the endpoint that ran it.  Both hooks are a couple of clock
+    reads and additions per statement.
+    """
+
+    def start_timer(conn, cursor, statement, parameters, context,
+                    executemany):
+        conn.info.setdefault('query_start_time', []).append(time.time())
+
+    def stop_timer(conn, cursor, statement, parameters, context,
+                   executemany):
+        elapsed = time.time() - conn.info['query_start_time'].pop()
+        if not has_request_context() or \
+                not app.config['SQL_INSTRUMENTATION']:
+            return
+        g.sql_count = g.get('sql_count', 0) + 1
+        g.sql_time = g.get('sql_time', 0.0) + elapsed
+        if elapsed * 1000 >= app.config['SLOW_QUERY_THRESHOLD_MS']:
+            now = datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+            slow_log.write_line('\n{} {:.1f}ms {}: {}'.format(
+                now, elapsed * 1000, request.endpoint,
+                normalize_sql(statement)))
+
+    def drop_timer(context):
+        # a failed statement never reaches stop_timer; drop its start so
+        # the next statement on this connection is not timed against it
+        if context.connection is not None:
+            started = context.connection.info.get('query_start_time')
+            if started:
+                started.pop()
+
+    def listen(engine):
+        event.listen(engine, 'before_cursor_execute', start_timer)
+        event.listen(engine, 'after_cursor_execute', stop_timer)
+        event.listen(engine, 'handle_error', drop_timer)
+
+    db.on_engine(app, listen)
+
+    @app.after_request
+    def add_server_timing(response):
+        if app.config['SQL_INSTRUMENTATION']:
+            response.headers.add(
+                'Server-Timing', 'db;dur={:.2f};desc="{} queries"'.format(
+                    g.get('sql_time', 0.0) * 1000, g.get('sql_count', 0)))
+        return response
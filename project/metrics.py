@@ -0,0 +1,336 @@
+# project/metrics.py
+
+
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on Windows
+    fcntl = None
+
+from flask import g, request, Response
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+# running totals of every worker that has exited
+EXITED_FILE = 'metrics-exited.json'
+
+
+def _bucket(buckets, value):
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            return i
+    return len(buckets)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _label_string(names, values):
+    return ','.join('{}="{}"'.format(
+        n, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for n, v in zip(names, values))
+
+
+class Metrics(object):
+    """Per-endpoint request metrics in Prometheus text format.
+
+    Every worker process updates its own dicts, and a background thread
+    writes a snapshot to ``METRICS_DIR/metrics-<pid>.json`` every
+    ``METRICS_FLUSH_INTERVAL`` seconds while there is anything new, and
+    again when the worker exits, so an idle worker is never behind.
+    When a worker has exited, ``retire()`` folds its snapshot into
+    ``metrics-exited.json``, so the counters never go backwards and the
+    directory holds one file per live worker.  ``/metrics`` adds them
+    all up.  Clear the directory when the server (not a single worker)
+    starts.
+    """
+
+    def __init__(self, app=None, blueprint_of=None):
+        self.blueprint_of = blueprint_of or (lambda: request.blueprint)
+        self.collectors = []
+        self.directory = None
+        self.flush_interval = 1.0
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def _reset(self):
+        # a forked worker starts from empty counters, fresh locks and no
+        # flusher, since threads do not survive fork
+        self._pid = os.getpid()
+        self._last_dump = 0
+        self._dirty = False
+        self._flusher = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._dump_lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.size = {}
+
+    def init_app(self, app):
+        self.directory = app.config['METRICS_DIR']
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        app.before_request(self.start_timer)
+        app.after_request(self.record)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        atexit.register(self._dump_at_exit)
+
+    def add_collector(self, name, kind, help_text, fn):
+        """Report ``fn()`` as a counter or gauge, summed over workers."""
+        self.collectors.append((name, kind, help_text, fn))
+
+    #################
+    # recording     #
+    #################
+
+    def start_timer(self):
+        g.metrics_start = time.time()
+
+    def record(self, response):
+        start = g.get('metrics_start')
+        if start is None or request.endpoint == 'metrics':
+            return response
+        if self._pid != os.getpid():
+            self._reset()
+        elapsed = time.time() - start
+        endpoint = request.endpoint or 'none'
+        key = (self.blueprint_of() or '', endpoint)
+        status_key = key + (request.method, str(response.status_code))
+        with self._lock:
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            if not response.is_streamed:
+                self._observe(self.latency, key, LATENCY_BUCKETS, elapsed)
+            if response.content_length is not None:
+                self._observe(self.size, key, SIZE_BUCKETS,
+                              response.content_length)
+            self._dirty = True
+        if response.is_streamed:
+            # the body is still to be generated; time it to the end
+            response.call_on_close(lambda: self._observe_latency(
+                key, time.time() - start))
+        if self._flusher is None and self.directory:
+            self._start_flusher()
+        return response
+
+    def _observe_latency(self, key, elapsed):
+        with self._lock:
+            self._observe(self.latency, key, LATENCY_BUCKETS, elapsed)
+            self._dirty = True
+
+    def _observe(self, histograms, key, buckets, value):
+        counts = histograms.get(key)
+        if counts is None:
+            # one slot per bucket, then +Inf, then the running sum
+            counts = histograms[key] = [0] * (len(buckets) + 2)
+        counts[_bucket(buckets, value)] += 1
+        counts[-1] += value
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop,
+                                             name='metrics-flusher')
+            self._flusher.daemon = True
+        self._flusher.start()
+
+    def _flush_loop(self):
+        stopped = self._stopped
+        while not stopped.wait(self.flush_interval):
+            if self._dirty:
+                try:
+                    self.dump()
+                except EnvironmentError:
+                    # a full or missing disk must not kill the thread
+                    continue
+
+    #################
+    # aggregation   #
+    #################
+
+    def snapshot(self):
+        with self._lock:
+            self._dirty = False
+            snapshot = {
+                'requests': [list(k) + [v]
+                             for k, v in self.requests.items()],
+                'latency': [list(k) + [list(v)]
+                            for k, v in self.latency.items()],
+                'size': [list(k) + [list(v)] for k, v in self.size.items()],
+            }
+        snapshot['collectors'] = dict(
+            (c[0], c[3]()) for c in self.collectors)
+        return snapshot
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self, exclusive):
+        """Keep ``collect`` from reading halfway through a ``retire``."""
+        if fcntl is None:
+            yield
+            return
+        with open(self._path('metrics.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _write(self, path, snapshot):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f)
+        os.rename(tmp, path)
+
+    def dump(self):
+        if not self.directory:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        pid = os.getpid()
+        path = self._path('metrics-{}.json'.format(pid))
+        # the flusher and a /metrics request may dump at the same time
+        with self._dump_lock:
+            if not self._last_dump and os.path.exists(path):
+                # left by an exited process that had the same pid
+                self.retire(pid)
+            self._write(path, self.snapshot())
+            self._last_dump = time.time()
+
+    def _dump_at_exit(self):
+        # only a process that served requests; a forked worker that never
+        # did still holds the master's pid
+        if self._pid == os.getpid():
+            # let the flusher finish before the interpreter tears down
+            self._stopped.set()
+            if self._flusher is not None:
+                self._flusher.join(self.flush_interval)
+            if self.requests:
+                self.dump()
+
+    def retire(self, pid):
+        """Fold the snapshot of exited worker ``pid`` into the totals."""
+        if not self.directory:
+            return
+        path = self._path('metrics-{}.json'.format(pid))
+        if not os.path.exists(path):
+            return
+        with self._locked(exclusive=True):
+            snapshots = self._read([path, self._path(EXITED_FILE)])
+            self._write(self._path(EXITED_FILE),
+                        self._as_snapshot(self._merge(snapshots)))
+            os.remove(path)
+
+    def _read(self, paths):
+        snapshots = []
+        for path in paths:
+            name = os.path.basename(path)
+            pid = None if name == EXITED_FILE else int(name[8:-5])
+            try:
+                with open(path) as f:
+                    snapshots.append((pid, json.load(f)))
+            except (IOError, ValueError):
+                continue
+        return snapshots
+
+    def collect(self):
+        if not self.directory:
+            return self._merge([(os.getpid(), self.snapshot())])
+        self.dump()
+        with self._locked(exclusive=False):
+            return self._merge(self._read(glob.glob(
+                self._path('metrics-*.json'))))
+
+    def _merge(self, snapshots):
+        """Sum ``(pid, snapshot)`` pairs; a pid of None has exited."""
+        gauges = set(c[0] for c in self.collectors if c[1] == 'gauge')
+        merged = {'requests': {}, 'latency': {}, 'size': {},
+                  'collectors': {}}
+        for pid, snap in snapshots:
+            for kind in ('requests', 'latency', 'size'):
+                for row in snap[kind]:
+                    key, value = tuple(row[:-1]), row[-1]
+                    if kind == 'requests':
+                        merged[kind][key] = merged[kind].get(key, 0) + value
+                    else:
+                        total = merged[kind].setdefault(
+                            key, [0] * len(value))
+                        for i, v in enumerate(value):
+                            total[i] += v
+            for name, value in snap['collectors'].items():
+                # a gauge describes now, so exited workers drop out of it
+                if name in gauges and (pid is None or not _alive(pid)):
+                    continue
+                merged['collectors'][name] = \
+                    merged['collectors'].get(name, 0) + value
+        return merged
+
+    def _as_snapshot(self, merged):
+        snapshot = dict((kind, [list(k) + [v] for k, v in
+                                merged[kind].items()])
+                        for kind in ('requests', 'latency', 'size'))
+        snapshot['collectors'] = merged['collectors']
+        return snapshot
+
+    #################
+    # exposition    #
+    #################
+
+    def render(self, merged):
+        lines = [
+            '# HELP flasktaskr_http_requests_total Requests handled.',
+            '# TYPE flasktaskr_http_requests_total counter',
+        ]
+        names = ('blueprint', 'endpoint', 'method', 'status')
+        for key in sorted(merged['requests']):
+            lines.append('flasktaskr_http_requests_total{{{}}} {}'.format(
+                _label_string(names, key), merged['requests'][key]))
+        self._render_histogram(
+            lines, 'flasktaskr_http_request_duration_seconds',
+            'Time spent handling requests.', LATENCY_BUCKETS,
+            merged['latency'])
+        self._render_histogram(
+            lines, 'flasktaskr_http_response_size_bytes',
+            'Size of response bodies.', SIZE_BUCKETS, merged['size'])
+        for name, kind, help_text, fn in self.collectors:
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            lines.append('{} {}'.format(
+                name, merged['collectors'].get(name, 0)))
+        return '\n'.join(lines) + '\n'
+
+    def _render_histogram(self, lines, name, help_text, buckets, histograms):
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} histogram'.format(name))
+        names = ('blueprint', 'endpoint')
+        for key in sorted(histograms):
+            counts = histograms[key]
+            labels = _label_string(names, key)
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], counts[:-1]):
+                cumulative += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    name, labels, bound, cumulative))
+            lines.append('{}_sum{{{}}} {}'.format(name, labels, counts[-1]))
+            lines.append('{}_count{{{}}} {}'.format(name, labels, cumulative))
+
+    def view(self):
+        return Response(self.render(self.collect()),
+                        mimetype='text/plain; version=0.0.4')
@@ -1,10 +1,29 @@
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, \
+    BadSignature
+from sqlalchemy import text
 from project import db
 import datetime
+import hashlib
 
 
 class Task(db.Model):
 
     __tablename__ = "tasks"
+    # back the api_v2 list filters in both sort orders: every index on the
+    # equality filters comes once ending in due_date, for the
+    # (due_date, task_id) keyset, and once bare, where SQLite keeps
+    # matching rows in task_id (rowid) order
+    __table_args__ = (
+        db.Index('ix_tasks_status', 'status'),
+        db.Index('ix_tasks_status_due_date', 'status', 'due_date'),
+        db.Index('ix_tasks_user_id', 'user_id'),
+        db.Index('ix_tasks_user_id_due_date', 'user_id', 'due_date'),
+        db.Index('ix_tasks_user_id_status', 'user_id', 'status'),
+        db.Index('ix_tasks_user_id_status_due_date',
+                 'user_id', 'status', 'due_date'),
+        db.Index('ix_tasks_due_date', 'due_date'),
+    )
 
     task_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -26,6 +45,41 @@ class Task(db.Model):
         return '<name{0}>'.format(self.name)
 
 
+def create_task_indexes(connection):
+    """Bring an existing database's task indexes up to date.
+
+    create_all() only builds them along with a new tasks table.  Indexes
+    that Task no longer declares are dropped, since each one costs every
+    write.
+    """
+    declared = set(index.name for index in Task.__table__.indexes)
+    for row in connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = 'tasks' AND name LIKE 'ix_tasks_%'")).fetchall():
+        if row[0] not in declared:
+            connection.execute(text('DROP INDEX {}'.format(row[0])))
+    for index in Task.__table__.indexes:
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                index.name, index.table.name,
+                ', '.join(c.name for c in index.columns))))
+
+
+class TaskCount(db.Model):
+    """Running task counts by status for one value of one dimension."""
+
+    __tablename__ = 'task_counts'
+
+    dimension = db.Column(db.String, primary_key=True)
+    key = db.Column(db.String, primary_key=True)
+    status = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<TaskCount {0}={1} status={2}: {3}>'.format(
+            self.dimension, self.key, self.status, self.count)
+
+
 class User(db.Model):
 
     __tablename__ = 'users'
@@ -43,5 +97,28 @@ class User(db.Model):
         self.password = password
         self.role = role
 
+    def password_fingerprint(self):
+        # changes whenever the password hash does, which revokes old tokens
+        return hashlib.sha1(self.password.encode('utf-8')).hexdigest()[:16]
+
+    def generate_auth_token(self, expiration=None):
+        if expiration is None:
+            expiration = current_app.config['API_TOKEN_EXPIRATION']
+        s = Serializer(current_app.config['SECRET_KEY'],
+                       expires_in=expiration)
+        return s.dumps({'id': self.id, 'pw': self.password_fingerprint()})
+
+    @staticmethod
+    def verify_auth_token(token):
+        s = Serializer(current_app.config['SECRET_KEY'])
+        try:
+            data = s.loads(token)
+        except (BadSignature, ValueError, TypeError):
+            return None
+        user = User.query.get(data.get('id'))
+        if user is None or user.password_fingerprint() != data.get('pw'):
+            return None
+        return user
+
     def __repr__(self):
         return '<User {0}>'.format(self.name)
\ No newline at end of file
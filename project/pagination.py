@@ -0,0 +1,135 @@
+# project/pagination.py
+
+
+from collections import namedtuple
+from datetime import datetime, date
+
+from flask import current_app, request, url_for
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import literal, tuple_
+
+
+################
+#### config ####
+################
+
+Page = namedtuple('Page', ['items', 'next_cursor', 'prev_cursor'])
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+##########################
+#### helper functions ####
+##########################
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'],
+                             salt='task-cursor')
+
+
+def _dump_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _load_value(column, value):
+    if column.type.python_type is date:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+
+def _scope(columns, descending):
+    return ','.join(c.key for c in columns) + (' desc' if descending else '')
+
+
+def encode_cursor(direction, key, scope):
+    return _serializer().dumps(
+        [direction, [_dump_value(v) for v in key], scope])
+
+
+def decode_cursor(cursor, columns, scope):
+    """Return (direction, key) for an opaque cursor token.
+
+    Tokens are signed, so a tampered or truncated cursor is rejected
+    instead of producing a query with arbitrary bounds.  A cursor issued
+    for one sort order is rejected when replayed against another.
+    """
+    try:
+        direction, key, cursor_scope = _serializer().loads(cursor)
+    except (BadSignature, ValueError, TypeError):
+        raise InvalidCursor('invalid cursor')
+    if direction not in ('next', 'prev') or cursor_scope != scope or \
+            len(key) != len(columns):
+        raise InvalidCursor('invalid cursor')
+    try:
+        return direction, [_load_value(c, v) for c, v in zip(columns, key)]
+    except (ValueError, TypeError):
+        raise InvalidCursor('invalid cursor')
+
+
+def page_size(limit=None, config_prefix='API'):
+    """``limit`` bounded by the <prefix>_PAGE_SIZE settings."""
+    default = current_app.config[config_prefix + '_PAGE_SIZE']
+    maximum = current_app.config[config_prefix + '_MAX_PAGE_SIZE']
+    if limit is None or limit < 1:
+        return default
+    return min(limit, maximum)
+
+
+def page_url(cursor):
+    """Link to the page at ``cursor``, keeping the request's other filters."""
+    if cursor is None:
+        return None
+    args = request.args.to_dict()
+    args['cursor'] = cursor
+    return url_for(request.endpoint, **args)
+
+
+def _row_key(row, columns):
+    return [getattr(row, c.key) for c in columns]
+
+
+def paginate(query, columns, cursor=None, limit=None, descending=False,
+             config_prefix='API'):
+    """Keyset pagination over ``columns``, which must end in a unique key.
+
+    Every page is a single bounded range scan on the sort index, so page
+    N costs the same as page 1 no matter how deep the client goes.
+    """
+    limit = page_size(limit, config_prefix)
+    scope = _scope(columns, descending)
+    direction, key = 'next', None
+    if cursor:
+        direction, key = decode_cursor(cursor, columns, scope)
+    forward = direction == 'next'
+    scan_ascending = forward != descending
+
+    if key is not None:
+        if len(columns) == 1:
+            lhs, rhs = columns[0], key[0]
+        else:
+            lhs = tuple_(*columns)
+            rhs = tuple_(*[literal(v, c.type) for c, v in zip(columns, key)])
+        query = query.filter(lhs > rhs if scan_ascending else lhs < rhs)
+    query = query.order_by(
+        *[c.asc() if scan_ascending else c.desc() for c in columns])
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or not forward:
+            next_cursor = encode_cursor(
+                'next', _row_key(rows[-1], columns), scope)
+        if (key is not None) if forward else has_more:
+            prev_cursor = encode_cursor(
+                'prev', _row_key(rows[0], columns), scope)
+    return Page(rows, next_cursor, prev_cursor)
@@ -0,0 +1,120 @@
+# project/search.py
+
+
+import re
+
+from sqlalchemy import DDL, Float, Integer, event, text
+from sqlalchemy.sql import column
+
+from project import db
+from project.models import Task, User
+
+
+################
+#### config ####
+################
+
+# tasks_fts is an external-content FTS5 index over tasks.name: it stores
+# only the inverted index and reads names back from tasks by rowid.  The
+# triggers keep it in step with every insert, rename and delete, however
+# the row is written.
+SEARCH_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks
+    BEGIN
+        INSERT INTO tasks_fts (rowid, name) VALUES (new.task_id, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks
+    BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, name)
+        VALUES ('delete', old.task_id, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_fts_update
+    AFTER UPDATE OF name ON tasks
+    BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, name)
+        VALUES ('delete', old.task_id, old.name);
+        INSERT INTO tasks_fts (rowid, name) VALUES (new.task_id, new.name);
+    END""",
+)
+SEARCH_TABLE = """CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+    name, content='tasks', content_rowid='task_id')"""
+
+# rank is bm25() by default.  The hits are joined back to tasks and
+# users, and (rank, task_id) is the key that search results page on
+SEARCH_HITS = text(
+    "SELECT rowid, rank FROM tasks_fts WHERE tasks_fts MATCH :query"
+).columns(column('rowid', Integer), column('rank', Float)).alias('hits')
+SEARCH_ORDER = [SEARCH_HITS.c.rank, Task.task_id]
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+for statement in (SEARCH_TABLE,) + SEARCH_TRIGGERS:
+    event.listen(Task.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Task.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS tasks_fts').execute_if(
+                 dialect='sqlite'))
+
+
+##########################
+#### helper functions ####
+##########################
+
+def create_search_index(connection, rebuild=False):
+    """Add the index and triggers to an existing database.
+
+    create_all() only builds them along with a new tasks table.  The
+    index is filled from tasks when it is first created, or whenever
+    ``rebuild`` is set (e.g. after loading rows with the triggers off).
+    """
+    exists = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE name = :name"),
+        name='tasks_fts').first()
+    connection.execute(text(SEARCH_TABLE))
+    for statement in SEARCH_TRIGGERS:
+        connection.execute(text(statement))
+    if rebuild or not exists:
+        connection.execute(text(
+            "INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')"))
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query, or None if it has no words.
+
+    Each word is quoted so punctuation and FTS operators in user input
+    are matched literally; all words must match and the last one is a
+    prefix, so results appear while a word is still being typed.
+    """
+    words = _WORD.findall(query or '')
+    if not words:
+        return None
+    terms = ['"{}"'.format(word) for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_query(query):
+    """Tasks matching ``query``, or None if it has no words.
+
+    Rows have the task_query() columns followed by poster_name and rank;
+    page them on SEARCH_ORDER, best match first.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return None
+    return db.session.query(
+        Task.task_id, Task.name, Task.due_date, Task.priority,
+        Task.posted_date, Task.status, Task.user_id,
+        User.name.label('poster_name'), SEARCH_HITS.c.rank
+    ).select_from(SEARCH_HITS).join(
+        Task, Task.task_id == SEARCH_HITS.c.rowid
+    ).outerjoin(User, User.id == Task.user_id).params(query=expression)
+
+
+def search_tasks(query, limit, offset=0):
+    """Best ``limit`` matches for ``query`` after skipping ``offset``."""
+    tasks = search_query(query)
+    if tasks is None:
+        return []
+    return tasks.order_by(*SEARCH_ORDER).limit(limit).offset(offset).all()
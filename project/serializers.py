@@ -0,0 +1,28 @@
+# project/serializers.py
+
+
+from project import db
+from project.models import Task
+
+
+# only the columns the API returns; querying these instead of Task skips
+# building and tracking an ORM instance for every row
+TASK_COLUMNS = (Task.task_id, Task.name, Task.due_date, Task.priority,
+                Task.posted_date, Task.status, Task.user_id)
+
+
+def task_query():
+    return db.session.query(*TASK_COLUMNS)
+
+
+def task_to_dict(row):
+    task_id, name, due_date, priority, posted_date, status, user_id = row
+    return {
+        'task_id': task_id,
+        'task_name': name,
+        'due_date': str(due_date),
+        'priority': priority,
+        'posted date': str(posted_date),
+        'status': status,
+        'user id': user_id
+    }
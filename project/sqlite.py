@@ -0,0 +1,89 @@
+# project/sqlite.py
+
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+from sqlalchemy import event
+
+
+_NAME = re.compile(r'^[a-z_]+$')
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """Set ``pragmas`` on a raw sqlite3 connection and read them back."""
+    cursor = dbapi_connection.cursor()
+    try:
+        applied = {}
+        for name, value in pragmas.items():
+            if not _NAME.match(name):
+                raise ValueError('invalid pragma name: {!r}'.format(name))
+            cursor.execute('PRAGMA {}={}'.format(name, value))
+        for name in pragmas:
+            row = cursor.execute('PRAGMA {}'.format(name)).fetchone()
+            applied[name] = row[0] if row else None
+        return applied
+    finally:
+        cursor.close()
+
+
+def journal_fell_back(applied, requested):
+    return 'journal_mode' in applied and \
+        str(applied['journal_mode']).lower() != \
+        str(requested['journal_mode']).lower()
+
+
+def format_report(applied, requested):
+    parts = []
+    for name in sorted(applied):
+        part = '{}={}'.format(name, applied[name])
+        if name == 'journal_mode' and journal_fell_back(applied, requested):
+            part += ' (requested {})'.format(requested[name])
+        parts.append(part)
+    return 'sqlite pragmas: ' + ', '.join(parts)
+
+
+def report_logger(app):
+    """Return (logger, level) for the pragma report.
+
+    Under gunicorn that is its error log, which shows INFO by default.
+    Elsewhere Flask's logger drops anything below WARNING unless in
+    debug mode, so the report goes out as a warning.
+    """
+    gunicorn = logging.getLogger('gunicorn.error')
+    if gunicorn.handlers:
+        return gunicorn, logging.INFO
+    return app.logger, logging.WARNING
+
+
+def init_sqlite(app, db):
+    """Apply SQLITE_PRAGMAS to every new SQLite connection of ``app``.
+
+    The values actually in effect are logged once per process, the first
+    time a connection is opened, so a worker that silently fell back from
+    WAL (e.g. on a network filesystem) shows up in the startup log.
+    """
+    state = {'reported': None}
+    lock = threading.Lock()
+
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        requested = app.config['SQLITE_PRAGMAS']
+        applied = apply_pragmas(dbapi_connection, requested)
+        app.extensions['sqlite_pragmas'] = applied
+        with lock:
+            if state['reported'] == os.getpid():
+                return
+            state['reported'] = os.getpid()
+        logger, level = report_logger(app)
+        if journal_fell_back(applied, requested):
+            level = logging.WARNING
+        logger.log(level, format_report(applied, requested))
+
+    db.on_engine(app, lambda engine: event.listen(
+        engine, 'connect', set_sqlite_pragmas))
+    return set_sqlite_pragmas
@@ -0,0 +1,128 @@
+# project/stats.py
+
+
+from collections import namedtuple
+from datetime import date
+
+from sqlalchemy import DDL, event, text
+
+from project import db
+from project.models import Task
+
+
+################
+#### config ####
+################
+
+# task_counts holds one row per (dimension, key, status).  due_date is
+# kept as a dimension so overdue totals are a sum over a few hundred
+# dates rather than a scan of tasks.
+DIMENSIONS = (('user', 'user_id'), ('priority', 'priority'),
+              ('due_date', 'due_date'))
+
+Drift = namedtuple('Drift', ['dimension', 'key', 'status', 'stored',
+                             'actual'])
+
+
+def _adjust(row, delta):
+    return ''.join(
+        "INSERT INTO task_counts (dimension, key, status, count) "
+        "VALUES ('{0}', IFNULL(CAST({1}.{2} AS TEXT), ''), {1}.status, {3}) "
+        "ON CONFLICT (dimension, key, status) "
+        "DO UPDATE SET count = count + excluded.count;\n".format(
+            dimension, row, column, delta)
+        for dimension, column in DIMENSIONS)
+
+
+# the triggers run inside whatever transaction writes the task, so the
+# counts commit or roll back with it whichever code path did the write
+STATS_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS task_counts_insert AFTER INSERT ON tasks "
+    "BEGIN\n" + _adjust('new', 1) + "END",
+    "CREATE TRIGGER IF NOT EXISTS task_counts_delete AFTER DELETE ON tasks "
+    "BEGIN\n" + _adjust('old', -1) + "END",
+    "CREATE TRIGGER IF NOT EXISTS task_counts_update "
+    "AFTER UPDATE OF user_id, priority, due_date, status ON tasks "
+    "BEGIN\n" + _adjust('old', -1) + _adjust('new', 1) + "END",
+)
+
+ACTUAL_COUNTS_SQL = '\nUNION ALL\n'.join(
+    "SELECT '{0}', IFNULL(CAST({1} AS TEXT), ''), status, COUNT(*) "
+    "FROM tasks GROUP BY 2, 3".format(dimension, column)
+    for dimension, column in DIMENSIONS)
+
+
+for statement in STATS_TRIGGERS:
+    event.listen(Task.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+
+
+##########################
+#### helper functions ####
+##########################
+
+def _stored_counts(connection):
+    return dict(((row[0], row[1], row[2]), row[3]) for row in
+                connection.execute(text(
+                    'SELECT dimension, key, status, count FROM task_counts '
+                    'WHERE count != 0')))
+
+
+def rebuild_task_counts(connection):
+    connection.execute(text('DELETE FROM task_counts'))
+    connection.execute(text(
+        'INSERT INTO task_counts (dimension, key, status, count) ' +
+        ACTUAL_COUNTS_SQL))
+
+
+def reconcile(connection, repair=True):
+    """Compare task_counts with the tasks table; return a list of Drift.
+
+    With ``repair`` the counts are rebuilt from scratch afterwards.  Run
+    it inside a transaction so no task write lands in between.
+    """
+    stored = _stored_counts(connection)
+    actual = dict(((row[0], row[1], row[2]), row[3])
+                  for row in connection.execute(text(ACTUAL_COUNTS_SQL)))
+    drift = [Drift(key[0], key[1], key[2], stored.get(key, 0),
+                   actual.get(key, 0))
+             for key in sorted(set(stored) | set(actual))
+             if stored.get(key, 0) != actual.get(key, 0)]
+    if repair:
+        rebuild_task_counts(connection)
+    return drift
+
+
+def create_task_counts(connection):
+    """Add the triggers to a database created before they existed."""
+    existing = set(row[0] for row in connection.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+        "AND name LIKE 'task_counts_%'")))
+    for statement in STATS_TRIGGERS:
+        connection.execute(text(statement))
+    if len(existing) < len(STATS_TRIGGERS):
+        rebuild_task_counts(connection)
+
+
+def task_stats(today=None):
+    """Open/closed totals overall, per user and per priority, and the
+    number of open tasks due before ``today``."""
+    today = today or date.today()
+    rows = db.session.execute(text(
+        "SELECT dimension, key, status, count FROM task_counts "
+        "WHERE dimension IN ('user', 'priority') AND count != 0"))
+    by = {'user': {}, 'priority': {}}
+    totals = {'open': 0, 'closed': 0}
+    for dimension, key, status, count in rows:
+        state = 'open' if status == 1 else 'closed'
+        counts = by[dimension].setdefault(key, {'open': 0, 'closed': 0})
+        counts[state] += count
+        if dimension == 'priority':
+            totals[state] += count
+    overdue = db.session.execute(text(
+        "SELECT IFNULL(SUM(count), 0) FROM task_counts "
+        "WHERE dimension = 'due_date' AND status = 1 AND key < :today"),
+        {'today': today.isoformat()}).scalar()
+    return {'open': totals['open'], 'closed': totals['closed'],
+            'overdue': overdue, 'by_user': by['user'],
+            'by_priority': by['priority']}
@@ -3,12 +3,15 @@
 
 import datetime
 from functools import wraps
-from flask import flash, redirect, render_template, request, session,\
-    url_for, Blueprint
+from flask import flash, redirect, request, session, url_for, Blueprint, \
+    current_app, Response, get_flashed_messages, stream_with_context, \
+    _request_ctx_stack
 
 from .forms import AddTaskForm
-from project import db
-from project.models import Task
+from project import db, task_cache
+from project.models import Task, User
+from project.pagination import Page, paginate, page_size, InvalidCursor
+from project.search import search_query, SEARCH_ORDER
 
 
 ##################
@@ -17,6 +20,10 @@ from project.models import Task
 
 task_blueprint = Blueprint('tasks', __name__)
 
+# template events joined into each streamed chunk; big enough that the
+# per-chunk compression flush stays cheap
+STREAM_BUFFER = 50
+
 
 #############################
 ###### helper functions #####
@@ -33,14 +40,100 @@ def login_required(test):
     return wrap
 
 
-def open_tasks():
-    return db.session.query(Task).filter_by(
-        status='1').order_by(Task.due_date.asc())
-
-
-def closed_tasks():
-    return db.session.query(Task).filter_by(
-        status='0').order_by(Task.due_date.asc())
+def stream_template(template_name, **context):
+    """Like render_template, but sends the page as it is rendered.
+
+    The session cookie goes out with the headers, before the body, so
+    anything that changes the session has to happen first: the flashed
+    messages are popped here, and the CSRF token is made with the form.
+    """
+    app = current_app._get_current_object()
+    get_flashed_messages()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+    ctx = _request_ctx_stack.top
+    session = ctx.session
+    body = stream_with_context(stream)
+    # pushing the context again reopens the session from the cookie,
+    # which would undo the changes above
+    ctx.session = session
+    return Response(body)
+
+
+# rows are plain tuples with the poster's name joined in, so the template
+# needs no lazy loads and the pages can be cached between requests
+def task_rows(status):
+    return db.session.query(
+        Task.task_id, Task.name, Task.due_date, Task.posted_date,
+        Task.priority, Task.status, Task.user_id,
+        User.name.label('poster_name')
+    ).outerjoin(User, Task.user_id == User.id).filter(Task.status == status)
+
+
+TASK_ORDER = [Task.due_date, Task.task_id]
+
+
+def task_page(cache_key, status, cursor, per_page):
+    """One keyset page of the open or closed tasks on /tasks/."""
+    def load():
+        try:
+            return paginate(task_rows(status), TASK_ORDER, cursor=cursor,
+                            limit=per_page, config_prefix='TASKS')
+        except InvalidCursor:
+            # a stale link, e.g. from before a SECRET_KEY change
+            return paginate(task_rows(status), TASK_ORDER, limit=per_page,
+                            config_prefix='TASKS')
+    return task_cache.get_or_set((cache_key, cursor, per_page), load)
+
+
+def search_page(query, cursor, per_page):
+    """One keyset page of the tasks matching ``query``, best first."""
+    tasks = search_query(query)
+    if tasks is None:
+        return Page([], None, None)
+    try:
+        return paginate(tasks, SEARCH_ORDER, cursor=cursor, limit=per_page,
+                        config_prefix='TASKS')
+    except InvalidCursor:
+        return paginate(tasks, SEARCH_ORDER, limit=per_page,
+                        config_prefix='TASKS')
+
+
+def open_tasks(cursor, per_page):
+    return task_page('open_tasks', '1', cursor, per_page)
+
+
+def closed_tasks(cursor, per_page):
+    return task_page('closed_tasks', '0', cursor, per_page)
+
+
+def section_url(name, cursor):
+    """This page's URL with one section moved to ``cursor``."""
+    args = request.args.to_dict()
+    args[name] = cursor
+    return url_for('tasks.tasks', **args)
+
+
+def render_tasks(form, query='', **context):
+    # query every page before streaming, so their time and queries are
+    # counted in the response's Server-Timing and metrics
+    per_page = page_size(request.args.get('per_page', type=int), 'TASKS')
+    search_results = None
+    if query:
+        search_results = search_page(
+            query, request.args.get('search_cursor'), per_page)
+    return stream_template(
+        'tasks.html',
+        form=form,
+        query=query,
+        search_results=search_results,
+        open_tasks=open_tasks(request.args.get('open_cursor'), per_page),
+        closed_tasks=closed_tasks(request.args.get('closed_cursor'),
+                                  per_page),
+        section_url=section_url,
+        **context
+    )
 
 
 #################
@@ -50,11 +143,9 @@ def closed_tasks():
 @task_blueprint.route('/tasks/')
 @login_required
 def tasks():
-    return render_template(
-        'tasks.html',
-        form=AddTaskForm(request.form),
-        open_tasks=open_tasks(),
-        closed_tasks=closed_tasks(),
+    return render_tasks(
+        AddTaskForm(request.form),
+        query=request.args.get('q', '').strip(),
         username=session['name']
     )
 
@@ -76,15 +167,10 @@ def new_task():
             )
             db.session.add(new_task)
             db.session.commit()
+            task_cache.invalidate()
             flash('New entry was successfully posted. Thanks.')
             return redirect(url_for('tasks.tasks'))
-    return render_template(
-        'tasks.html',
-        form=form,
-        error=error,
-        open_tasks=open_tasks(),
-        closed_tasks=closed_tasks()
-    )
+    return render_tasks(form, error=error)
 
 @task_blueprint.route('/complete/<int:task_id>/')
 @login_required
@@ -95,6 +181,7 @@ def complete(task_id):
                     session['role'] == 'admin':
         task.update({"status": "0"})
         db.session.commit()
+        task_cache.invalidate()
         flash('The task is complete. Nice.')
         return redirect(url_for('tasks.tasks'))
     else:
@@ -111,6 +198,7 @@ def delete_entry(task_id):
                     session['role'] == "admin":
         task.delete()
         db.session.commit()
+        task_cache.invalidate()
         flash('The task was deleted. Why not add a new one?')
         return redirect(url_for('tasks.tasks'))
     else:
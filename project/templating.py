@@ -0,0 +1,72 @@
+# project/templating.py
+
+
+import errno
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache
+
+
+class SharedBytecodeCache(FileSystemBytecodeCache):
+    """Compiled templates on disk, shared by every worker on the host.
+
+    Jinja compiles a template from source the first time a process loads
+    it.  With this cache only the first process does; later workers,
+    including recycled ones, unmarshal the stored bytecode.  Jinja
+    checksums the source, so an edited template is simply compiled again.
+    Files are written under a temporary name and renamed into place, so
+    a worker never reads one that another is halfway through writing,
+    and a cache that can't be read or written falls back to compiling.
+    """
+
+    def __init__(self, directory):
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        FileSystemBytecodeCache.__init__(self, directory)
+
+    def load_bytecode(self, bucket):
+        try:
+            FileSystemBytecodeCache.load_bytecode(self, bucket)
+        except Exception:
+            # damaged, or written by another interpreter version
+            bucket.reset()
+
+    def dump_bytecode(self, bucket):
+        try:
+            handle, temp = tempfile.mkstemp(prefix='.tmp',
+                                            dir=self.directory)
+        except EnvironmentError:
+            return
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.rename(temp, self._get_cache_filename(bucket))
+        except EnvironmentError:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+
+
+def init_template_cache(app):
+    directory = app.config['TEMPLATE_CACHE_DIR']
+    if directory:
+        app.jinja_env.bytecode_cache = SharedBytecodeCache(directory)
+
+
+def precompile(app):
+    """Load every template once, which fills the bytecode cache."""
+    names = list(app.jinja_env.list_templates(extensions=['html']))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+if __name__ == '__main__':
+    from project import app
+    for name in precompile(app):
+        print(name)
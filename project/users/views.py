@@ -11,7 +11,7 @@ from flask import flash, redirect, render_template, \
     request, session, url_for, Blueprint
 from sqlalchemy.exc import IntegrityError
 from .forms import RegisterForm, LoginForm
-from project import db, bcrypt
+from project import db, password_hasher
 from project.models import User
 
 
@@ -61,7 +61,7 @@ def login():
     if request.method == 'POST':
         if form.validate_on_submit():
             user = User.query.filter_by(name=request.form['name']).first()
-            if user is not None and bcrypt.check_password_hash(
+            if user is not None and password_hasher.check_password_hash(
                     user.password, request.form['password']):
                 session['logged_in'] = True
                 session['user_id'] = user.id
@@ -83,7 +83,7 @@ def register():
             new_user = User(
                 form.name.data,
                 form.email.data,
-                bcrypt.generate_password_hash(form.password.data)
+                password_hasher.generate_password_hash(form.password.data)
             )
 
             try:
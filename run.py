@@ -1,4 +1,7 @@
 # run.py
+#
+# Development server only; production runs gunicorn with
+# gunicorn_config.py (see the Procfile).
 
 
 import os
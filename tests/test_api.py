@@ -2,6 +2,7 @@
 
 
 import os
+import json
 import unittest
 from datetime import date
 
@@ -65,6 +66,14 @@ class APITests(unittest.TestCase):
         )
         db.session.commit()
 
+    def add_many_tasks(self, count):
+        for i in range(count):
+            db.session.add(
+                Task("Task {}".format(i), date(2015, 10, 22), 1,
+                     date(2015, 10, 5), 1, 1)
+            )
+        db.session.commit()
+
     ################
     #### tests #####
     ################
@@ -95,6 +104,37 @@ class APITests(unittest.TestCase):
         self.assertIn(b'Element does not exist', response.data)
 
 
+    def test_collection_endpoint_pages_with_cursor(self):
+        self.add_many_tasks(25)
+        response = self.app.get('api/v1/tasks/')
+        page = json.loads(response.data)
+        self.assertEquals(len(page['items']), 10)
+        self.assertIsNone(page['prev'])
+        seen = [item['task_id'] for item in page['items']]
+        while page['next']:
+            page = json.loads(self.app.get(page['next']).data)
+            seen.extend(item['task_id'] for item in page['items'])
+        self.assertEquals(seen, list(range(1, 26)))
+
+    def test_collection_endpoint_prev_link_returns_previous_page(self):
+        self.add_many_tasks(25)
+        first = json.loads(self.app.get('api/v1/tasks/?limit=5').data)
+        second = json.loads(self.app.get(first['next']).data)
+        back = json.loads(self.app.get(second['prev']).data)
+        self.assertEquals(back['items'], first['items'])
+        self.assertIsNotNone(back['next'])
+
+    def test_collection_endpoint_caps_page_size(self):
+        self.add_many_tasks(110)
+        response = self.app.get('api/v1/tasks/?limit=1000')
+        self.assertEquals(len(json.loads(response.data)['items']), 100)
+
+    def test_collection_endpoint_rejects_invalid_cursor(self):
+        self.add_tasks()
+        response = self.app.get('api/v1/tasks/?cursor=bogus')
+        self.assertEquals(response.status_code, 400)
+        self.assertIn(b'Invalid cursor', response.data)
+
     def test_valid_user_can_insert_a_task(self):
         data=dict(task="test api task")
         response = self.app.post('api/v1/add_task', data=data)
@@ -3,14 +3,21 @@
 
 import os
 import base64
+import io
+import itertools
 import unittest
 from datetime import date
 import json
 
+from sqlalchemy import event
+
 
 from project import app, db, bcrypt
 from project._config import basedir
-from project.models import Task
+from project.models import Task, User, create_task_indexes
+from project.stats import reconcile
+
+import db_reconcile
 
 
 TEST_DB = 'test.db'
@@ -68,6 +75,25 @@ class APIv2Tests(unittest.TestCase):
         )
         db.session.commit()
 
+    def add_filterable_tasks(self):
+        for i in range(40):
+            db.session.add(
+                Task("Task {}".format(i), date(2015, 1 + i % 12, 1 + i % 28),
+                     1 + i % 10, date(2015, 1, 1), i % 2, 1 + i % 3)
+            )
+        db.session.commit()
+
+    def get_items(self, url):
+        return json.loads(self.app.get(url).data)
+
+    def explain(self, statement, parameters):
+        connection = db.engine.raw_connection()
+        try:
+            return [row[-1] for row in connection.execute(
+                'EXPLAIN QUERY PLAN ' + statement, parameters)]
+        finally:
+            connection.close()
+
     def register(self, name, email, password, confirm):
         return self.app.post(
             'register/',
@@ -99,6 +125,349 @@ class APIv2Tests(unittest.TestCase):
         self.assertIn(b'Purchase Real Python', response.data)
 
 
+    def test_collection_endpoint_pages_with_link_header(self):
+        for i in range(15):
+            db.session.add(Task("Task {}".format(i), date(2015, 10, 22), 1,
+                                date(2015, 10, 5), 1, 1))
+        db.session.commit()
+        response = self.app.get('api/v2/tasks/')
+        self.assertEquals(len(json.loads(response.data)), 10)
+        self.assertIn('rel="next"', response.headers['Link'])
+        self.assertNotIn('rel="prev"', response.headers['Link'])
+        next_url = response.headers['Link'].split(';')[0].strip('<>')
+        response = self.app.get(next_url)
+        items = json.loads(response.data)
+        self.assertEquals([i['task_id'] for i in items], list(range(11, 16)))
+        self.assertIn('rel="prev"', response.headers['Link'])
+        self.assertNotIn('rel="next"', response.headers['Link'])
+
+    def test_collection_endpoint_rejects_invalid_cursor(self):
+        response = self.app.get('api/v2/tasks/?cursor=bogus')
+        self.assertEquals(response.status_code, 400)
+
+    def test_collection_endpoint_filters_tasks(self):
+        self.add_filterable_tasks()
+        items = self.get_items(
+            'api/v2/tasks/?status=1&user_id=2&priority_min=3&priority_max=8'
+            '&due_after=03/01/2015&due_before=10/31/2015&limit=100')
+        self.assertTrue(items)
+        for item in items:
+            self.assertEquals(item['status'], 1)
+            self.assertEquals(item['user id'], 2)
+            self.assertTrue(3 <= item['priority'] <= 8)
+            self.assertTrue('2015-03-01' <= item['due_date'] <= '2015-10-31')
+
+    def test_collection_endpoint_sorts_by_due_date_across_pages(self):
+        self.add_filterable_tasks()
+        url = 'api/v2/tasks/?sort=-due_date&status=0&limit=7'
+        response = self.app.get(url)
+        seen = json.loads(response.data)
+        while 'rel="next"' in response.headers.get('Link', ''):
+            url = response.headers['Link'].split(';')[0].strip('<>')
+            self.assertIn('status=0', url)
+            response = self.app.get(url)
+            seen.extend(json.loads(response.data))
+        keys = [(item['due_date'], item['task_id']) for item in seen]
+        self.assertEquals(keys, sorted(keys, reverse=True))
+        self.assertEquals(len(seen), 20)
+
+    def test_collection_endpoint_rejects_cursor_from_other_sort(self):
+        self.add_filterable_tasks()
+        response = self.app.get('api/v2/tasks/?sort=task_id')
+        url = response.headers['Link'].split(';')[0].strip('<>')
+        response = self.app.get(url.replace('sort=task_id', 'sort=-task_id'))
+        self.assertEquals(response.status_code, 400)
+
+    def test_collection_endpoint_rejects_unknown_sort(self):
+        response = self.app.get('api/v2/tasks/?sort=name')
+        self.assertEquals(response.status_code, 400)
+
+    def test_collection_filters_never_scan_the_tasks_table(self):
+        self.add_filterable_tasks()
+        filters = ['status=1', 'user_id=2', 'priority_min=2&priority_max=6',
+                   'due_after=02/01/2015&due_before=11/30/2015']
+        sorts = ['task_id', '-task_id', 'due_date', '-due_date']
+        statements = []
+        walks_primary_key = [False]
+
+        def record(conn, cursor, statement, parameters, *args):
+            if statement.lstrip().startswith('SELECT'):
+                statements.append(
+                    (statement, parameters, walks_primary_key[0]))
+
+        # an unfiltered listing walks the primary key or the due_date index
+        # and stops after one page, so only the filtered combinations are
+        # checked here
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            for count in range(1, len(filters) + 1):
+                for combo in itertools.combinations(filters, count):
+                    for sort in sorts:
+                        # range filters alone leave task_id order to the
+                        # primary key, walked in order up to the limit
+                        walks_primary_key[0] = sort.endswith('task_id') \
+                            and not any(f.startswith(('status', 'user_id'))
+                                        for f in combo)
+                        url = 'api/v2/tasks/?limit=1&sort={}&{}'.format(
+                            sort, '&'.join(combo))
+                        response = self.app.get(url)
+                        self.assertEquals(response.status_code, 200)
+                        link = response.headers.get('Link')
+                        if link:
+                            self.app.get(link.split(';')[0].strip('<>'))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertTrue(statements)
+        for statement, parameters, walks in statements:
+            for detail in self.explain(statement, parameters):
+                # a sort would read every match to return one page
+                self.assertNotIn('TEMP B-TREE', detail, statement)
+                if walks and detail == 'SCAN tasks':
+                    continue
+                self.assertFalse(
+                    detail.startswith('SCAN') and 'INDEX' not in detail,
+                    '{}\n{}'.format(detail, statement))
+
+    def test_task_indexes_are_added_to_an_existing_database(self):
+        names = sorted(index.name for index in Task.__table__.indexes)
+        indexes = lambda: sorted(row[0] for row in db.session.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = 'tasks' AND name LIKE 'ix_tasks_%'"))
+        with db.engine.begin() as connection:
+            for name in names:
+                connection.execute('DROP INDEX {}'.format(name))
+            connection.execute(
+                'CREATE INDEX ix_tasks_priority_due_date '
+                'ON tasks (priority, due_date)')
+        self.assertEquals(indexes(), ['ix_tasks_priority_due_date'])
+        for _ in range(2):
+            with db.engine.begin() as connection:
+                create_task_indexes(connection)
+            self.assertEquals(indexes(), names)
+
+    def test_bulk_endpoint_creates_updates_and_deletes(self):
+        header = self.post_a_task()
+        self.app.post('api/v2/tasks/', headers=header, data=json.dumps(
+            {'name': 'second task', 'due_date': '05/25/2018',
+             'priority': 2}))
+        data = {
+            'create': [{'name': 'bulk {}'.format(i),
+                        'due_date': '01/0{}/2019'.format(1 + i % 9),
+                        'priority': i % 10} for i in range(50)],
+            'update': [{'task_id': 1, 'name': 'renamed',
+                        'due_date': '06/01/2018', 'priority': 3}],
+            'delete': [2],
+        }
+        response = self.app.post('api/v2/tasks/bulk', headers=header,
+                                 data=json.dumps(data))
+        self.assertEquals(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertEquals(result['created'], 50)
+        self.assertEquals(result['updated'], 1)
+        self.assertEquals(result['deleted'], 1)
+        self.assertEquals(db.session.query(Task).count(), 51)
+        self.assertEquals(db.session.query(Task).get(1).name, 'renamed')
+        self.assertIsNone(db.session.query(Task).get(2))
+
+    def test_bulk_endpoint_reports_per_item_errors(self):
+        header = self.post_a_task()
+        data = {
+            'create': [{'name': 'good', 'due_date': '01/01/2019',
+                        'priority': 1},
+                       {'name': 'bad date', 'due_date': '2019-01-01',
+                        'priority': 1}],
+            'update': [{'task_id': 99, 'name': 'missing',
+                        'due_date': '01/01/2019', 'priority': 1}],
+            'delete': ['abc', 1],
+        }
+        response = self.app.post('api/v2/tasks/bulk', headers=header,
+                                 data=json.dumps(data))
+        results = json.loads(response.data)['results']
+        self.assertEquals([r['status'] for r in results['create']],
+                          [201, 400])
+        self.assertEquals([r['status'] for r in results['update']], [404])
+        self.assertEquals([r['status'] for r in results['delete']],
+                          [400, 200])
+        self.assertEquals(
+            [t.name for t in db.session.query(Task).all()], ['good'])
+
+    def test_bulk_endpoint_requires_auth(self):
+        response = self.app.post(
+            'api/v2/tasks/bulk', data=json.dumps({'create': []}),
+            headers={'Content-Type': 'application/json'})
+        self.assertEquals(response.status_code, 401)
+
+    def get_token(self, header):
+        response = self.app.post('api/v2/token', headers=header)
+        self.assertEquals(response.status_code, 201)
+        return json.loads(response.data)['token']
+
+    def test_token_can_be_used_as_bearer_credentials(self):
+        token = self.get_token(self.post_a_task())
+        header = {'authorization': 'Bearer {}'.format(token),
+                  'Content-Type': 'application/json'}
+        data = {'name': 'token task', 'due_date': '05/25/2018',
+                'priority': 1}
+        response = self.app.post('api/v2/tasks/', headers=header,
+                                 data=json.dumps(data))
+        self.assertEquals(response.status_code, 201)
+
+    def test_token_can_be_used_as_basic_username(self):
+        token = self.get_token(self.post_a_task())
+        encoded = base64.standard_b64encode('{}:'.format(token))
+        header = {'authorization': 'Basic {}'.format(encoded)}
+        response = self.app.delete('api/v2/tasks/1', headers=header)
+        self.assertEquals(response.status_code, 201)
+
+    def test_token_cannot_issue_new_tokens(self):
+        token = self.get_token(self.post_a_task())
+        header = {'authorization': 'Bearer {}'.format(token)}
+        response = self.app.post('api/v2/token', headers=header)
+        self.assertEquals(response.status_code, 401)
+
+    def test_token_is_rejected_after_password_change(self):
+        token = self.get_token(self.post_a_task())
+        user = User.query.filter_by(name='Michael').first()
+        user.password = bcrypt.generate_password_hash('newpassword')
+        db.session.commit()
+        header = {'authorization': 'Bearer {}'.format(token)}
+        response = self.app.delete('api/v2/tasks/1', headers=header)
+        self.assertEquals(response.status_code, 401)
+
+    def test_expired_or_forged_token_is_rejected(self):
+        self.post_a_task()
+        user = User.query.filter_by(name='Michael').first()
+        with app.app_context():
+            expired = user.generate_auth_token(-1)
+        for token in (expired, 'not.a.token'):
+            header = {'authorization': 'Bearer {}'.format(token)}
+            response = self.app.delete('api/v2/tasks/1', headers=header)
+            self.assertEquals(response.status_code, 401)
+
+    def test_search_ranks_matching_tasks(self):
+        for name in ('Buy milk and bread for the week', 'Sell car',
+                     'Buy milk', 'Milky way poster'):
+            db.session.add(Task(name, date(2015, 10, 22), 1,
+                                date(2015, 10, 5), 1, 1))
+        db.session.commit()
+        items = self.get_items('api/v2/tasks/search?q=milk')
+        names = [i['task_name'] for i in items]
+        # bm25 ranks the shorter of two otherwise equal matches first;
+        # the last word is matched as a prefix
+        self.assertEquals(names[0], 'Buy milk')
+        self.assertEquals(names[-1], 'Buy milk and bread for the week')
+        self.assertIn('Milky way poster', names)
+        items = self.get_items('api/v2/tasks/search?q=buy%20milk')
+        self.assertEquals(len(items), 2)
+        self.assertEquals(self.get_items('api/v2/tasks/search?q=boat'), [])
+
+    def test_search_index_follows_updates_and_deletes(self):
+        header = self.post_a_task()
+        self.app.put('api/v2/tasks/1', headers=header, data=json.dumps(
+            {'name': 'renamed errand', 'due_date': '05/25/2018',
+             'priority': 1}))
+        self.assertEquals(self.get_items('api/v2/tasks/search?q=test'), [])
+        items = self.get_items('api/v2/tasks/search?q=errand')
+        self.assertEquals([i['task_id'] for i in items], [1])
+        self.app.post('api/v2/tasks/bulk', headers=header, data=json.dumps(
+            {'delete': [1], 'create': [{'name': 'bulk errand',
+                                        'due_date': '05/25/2018',
+                                        'priority': 1}]}))
+        items = self.get_items('api/v2/tasks/search?q=errand')
+        self.assertEquals([i['task_name'] for i in items], ['bulk errand'])
+
+    def test_search_pages_with_link_header(self):
+        for i in range(15):
+            db.session.add(Task("Errand {}".format(i), date(2015, 10, 22),
+                                1, date(2015, 10, 5), 1, 1))
+        db.session.commit()
+        response = self.app.get('api/v2/tasks/search?q=errand')
+        self.assertEquals(len(json.loads(response.data)), 10)
+        self.assertNotIn('rel="prev"', response.headers['Link'])
+        next_url = response.headers['Link'].split(';')[0].strip('<>')
+        response = self.app.get(next_url)
+        self.assertEquals(len(json.loads(response.data)), 5)
+        self.assertIn('rel="prev"', response.headers['Link'])
+        self.assertNotIn('rel="next"', response.headers['Link'])
+
+    def test_search_treats_query_syntax_as_text(self):
+        self.add_tasks()
+        for q in ('"unbalanced', 'NEAR(run', 'circles OR', '*', 'a:b'):
+            response = self.app.get('api/v2/tasks/search',
+                                    query_string={'q': q})
+            self.assertEquals(response.status_code, 200, q)
+        response = self.app.get('api/v2/tasks/search?q=')
+        self.assertEquals(response.status_code, 400)
+
+    def test_stats_follow_every_kind_of_write(self):
+        header = self.post_a_task()
+        self.app.post('api/v2/tasks/bulk', headers=header, data=json.dumps(
+            {'create': [{'name': 'bulk {}'.format(i),
+                         'due_date': '01/01/2015', 'priority': i % 2 + 1}
+                        for i in range(4)]}))
+        self.app.put('api/v2/tasks/2', headers=header, data=json.dumps(
+            {'name': 'moved', 'due_date': '05/25/2999', 'priority': 6}))
+        self.app.delete('api/v2/tasks/3', headers=header)
+        stats = self.get_items('api/v2/stats')
+        self.assertEquals(stats['open'], 4)
+        self.assertEquals(stats['closed'], 0)
+        # everything but the task moved to 2999 is past due
+        self.assertEquals(stats['overdue'], 3)
+        self.assertEquals(stats['by_user'], {'1': {'open': 4, 'closed': 0}})
+        self.assertEquals(stats['by_priority'],
+                          {'1': {'open': 1, 'closed': 0},
+                           '2': {'open': 1, 'closed': 0},
+                           '6': {'open': 2, 'closed': 0}})
+        with db.engine.begin() as connection:
+            self.assertEquals(reconcile(connection, repair=False), [])
+
+    def test_reconcile_reports_and_repairs_drift(self):
+        self.add_filterable_tasks()
+        db.session.execute("UPDATE task_counts SET count = count + 5 "
+                           "WHERE dimension = 'priority' AND key = '3'")
+        db.session.execute("DELETE FROM task_counts WHERE dimension = 'user'"
+                           " AND key = '2'")
+        db.session.commit()
+        out = io.StringIO() if str is not bytes else io.BytesIO()
+        drift = db_reconcile.run_reconcile(repair=False, out=out)
+        self.assertEquals(
+            sorted((d.dimension, d.key, d.stored - d.actual) for d in drift),
+            [('priority', '3', 5), ('user', '2', -7), ('user', '2', -6)])
+        self.assertIn('stored', out.getvalue())
+        db_reconcile.run_reconcile(out=out)
+        with db.engine.begin() as connection:
+            self.assertEquals(reconcile(connection, repair=False), [])
+        self.assertEquals(self.get_items('api/v2/stats')['open'], 20)
+
+    def test_export_streams_ndjson(self):
+        self.add_filterable_tasks()
+        response = self.app.get('api/v2/tasks/export?format=ndjson')
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEquals(response.mimetype, 'application/x-ndjson')
+        # the first row is sent before the rest are batched
+        chunks = list(response.response)
+        self.assertEquals(chunks[0].count(b'\n'), 1)
+        rows = [json.loads(line) for line in b''.join(chunks).splitlines()]
+        self.assertEquals([r['task_id'] for r in rows], list(range(1, 41)))
+        self.assertEquals(rows[0]['name'], 'Task 0')
+        self.assertEquals(rows[0]['posted_date'], '2015-01-01')
+
+    def test_export_streams_csv(self):
+        self.add_filterable_tasks()
+        response = self.app.get('api/v2/tasks/export?format=csv')
+        self.assertEquals(response.mimetype, 'text/csv')
+        lines = response.data.splitlines()
+        self.assertEquals(lines[0], b'task_id,name,due_date,priority,'
+                                    b'posted_date,status,user_id')
+        self.assertEquals(len(lines), 41)
+        self.assertTrue(lines[1].startswith(b'1,Task 0,2015-01-01,1,'))
+
+    def test_export_rejects_unknown_format(self):
+        response = self.app.get('api/v2/tasks/export?format=xml')
+        self.assertEquals(response.status_code, 400)
+
     def test_resource_endpoint_returns_correct_data(self):
         self.add_tasks()
         response = self.app.get('api/v2/tasks/2', follow_redirects=True)
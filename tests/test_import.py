@@ -0,0 +1,128 @@
+# tests/test_import.py
+
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+from project import app, db, bcrypt
+from project._config import basedir
+from project.models import Task, User
+
+import db_import
+
+
+TEST_DB = 'test.db'
+
+
+class ImportTests(unittest.TestCase):
+
+    ##########################
+    #### setup and teardown ##
+    ##########################
+
+    # executed prior to each test
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(basedir, TEST_DB)
+        self.directory = tempfile.mkdtemp()
+        self.out = io.StringIO() if str is not bytes else io.BytesIO()
+        db.create_all()
+
+    # executed after each test
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db_import.checkpoints.drop(db.engine, checkfirst=True)
+        shutil.rmtree(self.directory)
+
+    ###############################
+    #### helper methods ###########
+    ###############################
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def task_csv(self, count):
+        lines = ['name,due_date,priority,status,user_id']
+        for i in range(count):
+            lines.append('Task {},02/05/2015,{},1,1'.format(i, 1 + i % 10))
+        return self.write_file('tasks.csv', '\n'.join(lines) + '\n')
+
+    ################
+    #### tests #####
+    ################
+
+    def test_tasks_are_imported_in_chunks(self):
+        path = self.task_csv(25)
+        inserted = db_import.run_import('tasks', path, chunk_size=10,
+                                        out=self.out)
+        self.assertEquals(inserted, 25)
+        self.assertEquals(db.session.query(Task).count(), 25)
+        self.assertEquals(len(self.out.getvalue().splitlines()), 3)
+
+    def test_import_resumes_from_checkpoint(self):
+        path = self.task_csv(25)
+        with db.engine.begin() as connection:
+            db_import.checkpoints.create(connection, checkfirst=True)
+            db_import.set_checkpoint(
+                connection, 'tasks:' + os.path.abspath(path), 20)
+        inserted = db_import.run_import('tasks', path, chunk_size=10,
+                                        out=self.out)
+        self.assertEquals(inserted, 5)
+        names = [t.name for t in db.session.query(Task).all()]
+        self.assertEquals(names, ['Task {}'.format(i) for i in range(20, 25)])
+        self.assertEquals(
+            db_import.run_import('tasks', path, out=self.out), 0)
+
+    def test_closed_and_missing_statuses_are_imported(self):
+        path = self.write_file('tasks.ndjson', '\n'.join(json.dumps(
+            dict({'name': 'Task {}'.format(i), 'due_date': '2015-02-05',
+                  'priority': 1}, **status))
+            for i, status in enumerate([{'status': 0}, {'status': '0'},
+                                        {'status': None}, {}])))
+        db_import.run_import('tasks', path, out=self.out)
+        statuses = [t.status for t in
+                    db.session.query(Task).order_by(Task.task_id).all()]
+        self.assertEquals(statuses, [0, 0, 1, 1])
+
+    def test_exports_import_back_unchanged(self):
+        for i in range(3):
+            db.session.add(Task('Task {}'.format(i), date(2015, 2, 5 + i), i,
+                                date(2015, 2, 1), i % 2, i or None))
+        db.session.commit()
+        tasks = lambda: [
+            (t.name, t.due_date, t.priority, t.posted_date, t.status,
+             t.user_id)
+            for t in db.session.query(Task).order_by(Task.task_id)]
+        exported = tasks()
+        client = app.test_client()
+        for fmt in ('ndjson', 'csv'):
+            path = self.write_file('tasks.' + fmt, client.get(
+                'api/v2/tasks/export?format=' + fmt).data.decode('utf-8'))
+            db.session.query(Task).delete()
+            db.session.commit()
+            db_import.run_import('tasks', path, out=self.out)
+            self.assertEquals(tasks(), exported)
+
+    def test_users_are_imported_with_hashed_passwords(self):
+        path = self.write_file('users.ndjson', '\n'.join(json.dumps(
+            {'name': 'user{}'.format(i), 'email': 'u{}@realpython.com'.format(i),
+             'password': 'secret{}'.format(i)}) for i in range(2)))
+        db_import.run_import('users', path, workers=2, out=self.out)
+        users = db.session.query(User).order_by(User.id).all()
+        self.assertEquals([u.role for u in users], ['user', 'user'])
+        self.assertTrue(
+            bcrypt.check_password_hash(users[1].password, 'secret1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,16 +2,59 @@
 
 
 import os
+import json
+import logging
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import gzip
+import zlib
+from collections import namedtuple
+from datetime import date
 
-from project import app, db
+from flask import Flask, g
+from sqlalchemy.exc import OperationalError
+
+from project import app, db, error_log, slow_query_log, metrics, \
+    asset_manifest, task_cache, create_app
 from project._config import basedir
-from project.models import User
+from project.assets import AssetManifest, precompress
+from project.metrics import Metrics
+from project.templating import init_template_cache, precompile
+from project.errorlog import ErrorLogWriter
+from project.sqlite import format_report
+from project.instrumentation import normalize_sql
+from project.models import Task, User
 
 
 TEST_DB = 'test.db'
 
 
+# what gunicorn passes to its worker hooks
+Worker = namedtuple('Worker', ['pid'])
+
+# a worker that serves some requests and then sits idle
+IDLE_WORKER = r'''
+import sys, time
+from flask import Flask
+from project.metrics import Metrics
+worker = Flask('worker')
+worker.config.update(METRICS_DIR=sys.argv[1], METRICS_FLUSH_INTERVAL=0.05)
+Metrics(worker)
+worker.add_url_rule('/', 'index', lambda: 'ok')
+client = worker.test_client()
+for _ in range(int(sys.argv[2])):
+    client.get('/')
+print('served')
+sys.stdout.flush()
+time.sleep(30)
+'''
+
+
 class MainTests(unittest.TestCase):
 
     ##########################
@@ -53,6 +96,451 @@ class MainTests(unittest.TestCase):
         self.assertEquals(response.status_code, 404)
         self.assertIn(b'Sorry. There\'s nothing here.', response.data)
 
+    def test_404_error_is_written_to_error_log(self):
+        self.app.get('/this-route-does-not-exist/')
+        error_log.flush()
+        with open(error_log.path) as f:
+            self.assertIn('/this-route-does-not-exist/', f.read())
+
+    def test_error_log_rotates_and_drops_when_full(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'error.log')
+            writer = ErrorLogWriter(path=path, max_bytes=200, backup_count=2)
+            for i in range(30):
+                writer.write('/missing/{}'.format(i), '404')
+            writer.close()
+            self.assertTrue(os.path.exists(path + '.1'))
+            self.assertFalse(os.path.exists(path + '.3'))
+
+            release = threading.Event()
+
+            class StalledWriter(ErrorLogWriter):
+                def _work(self):
+                    release.wait()
+                    ErrorLogWriter._work(self)
+
+            writer = StalledWriter(path=path, queue_size=1)
+            writer.write('/missing/a', '404')
+            writer.write('/missing/b', '404')
+            self.assertEquals(writer.dropped, 1)
+            release.set()
+            writer.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_sqlite_connections_get_configured_pragmas(self):
+        connection = db.engine.connect()
+        try:
+            pragma = lambda name: connection.execute(
+                'PRAGMA {}'.format(name)).scalar()
+            self.assertEquals(pragma('journal_mode'), 'wal')
+            self.assertEquals(pragma('busy_timeout'), 5000)
+            self.assertEquals(pragma('synchronous'), 1)
+        finally:
+            connection.close()
+        self.assertEquals(app.extensions['sqlite_pragmas']['journal_mode'],
+                          'wal')
+
+    def test_sqlite_pragma_report_flags_journal_mode_fallback(self):
+        report = format_report({'journal_mode': 'delete', 'busy_timeout': 5},
+                               {'journal_mode': 'WAL', 'busy_timeout': 5})
+        self.assertEquals(report, 'sqlite pragmas: busy_timeout=5, '
+                                  'journal_mode=delete (requested WAL)')
+
+    def test_sqlite_pragma_report_reaches_the_gunicorn_log(self):
+        directory = tempfile.mkdtemp()
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        # as gunicorn sets up its error log
+        logger = logging.getLogger('gunicorn.error')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        try:
+            other = create_app({
+                'TESTING': True, 'METRICS_DIR': directory,
+                'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(
+                    directory, 'other.db')})
+            with other.app_context():
+                db.engine.connect().close()
+                db.engine.connect().close()
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
+            shutil.rmtree(directory)
+        self.assertEquals(len(records), 1)
+        self.assertEquals(records[0].levelno, logging.INFO)
+        self.assertIn('journal_mode=wal', records[0].getMessage())
+
+    def test_responses_report_sql_in_server_timing(self):
+        response = self.app.get('api/v2/tasks/1')
+        timing = response.headers['Server-Timing']
+        self.assertTrue(timing.startswith('db;dur='))
+        self.assertIn('desc="1 queries"', timing)
+
+    def test_slow_queries_are_logged_with_endpoint(self):
+        threshold = app.config['SLOW_QUERY_THRESHOLD_MS']
+        app.config['SLOW_QUERY_THRESHOLD_MS'] = 0
+        try:
+            self.app.get('api/v2/tasks/1')
+        finally:
+            app.config['SLOW_QUERY_THRESHOLD_MS'] = threshold
+        slow_query_log.flush()
+        with open(slow_query_log.path) as f:
+            last = f.read().splitlines()[-1]
+        self.assertIn('apitask: SELECT tasks.task_id', last)
+        self.assertIn('WHERE tasks.task_id = ? LIMIT ? OFFSET ?', last)
+
+    def test_failed_statements_do_not_leave_a_timer_behind(self):
+        with app.test_request_context(), db.engine.connect() as conn:
+            self.assertRaises(OperationalError, conn.execute,
+                              'SELECT * FROM no_such_table')
+            self.assertEquals(conn.execute('SELECT 1').scalar(), 1)
+            self.assertEquals(conn.info['query_start_time'], [])
+            self.assertEquals(g.sql_count, 1)
+
+    def test_normalize_sql_strips_literals(self):
+        self.assertEquals(
+            normalize_sql("SELECT *\n  FROM t WHERE a = 'x''y' AND b IN "
+                          "(?, ?, ?) AND c = 10"),
+            'SELECT * FROM t WHERE a = ? AND b IN (?, ...) AND c = ?')
+
+    def test_metrics_endpoint_reports_requests_per_blueprint(self):
+        self.app.get('/')
+        self.app.get('api/v2/tasks/')
+        response = self.app.get('/metrics')
+        self.assertEquals(response.status_code, 200)
+        self.assertIn(b'flasktaskr_http_requests_total{blueprint="users",'
+                      b'endpoint="users.login",method="GET",status="200"}',
+                      response.data)
+        self.assertIn(b'flasktaskr_http_request_duration_seconds_bucket'
+                      b'{blueprint="api_v2",endpoint="apitasklist",'
+                      b'le="+Inf"}', response.data)
+        self.assertIn(b'flasktaskr_task_cache_hits_total', response.data)
+
+    def test_metrics_are_summed_across_workers(self):
+        directory = tempfile.mkdtemp()
+        saved = metrics.directory
+        metrics.directory = directory
+        try:
+            # pid 1 stands in for another worker
+            other = {'requests': [['tasks', 'tasks.tasks', 'GET', '200', 5]],
+                     'latency': [], 'size': [],
+                     'collectors': {'flasktaskr_task_cache_hits_total': 7}}
+            with open(os.path.join(directory, 'metrics-1.json'), 'w') as f:
+                json.dump(other, f)
+            merged = metrics.collect()
+        finally:
+            metrics.directory = saved
+            shutil.rmtree(directory)
+        key = ('tasks', 'tasks.tasks', 'GET', '200')
+        self.assertTrue(merged['requests'][key] >= 5)
+        self.assertTrue(
+            merged['collectors']['flasktaskr_task_cache_hits_total'] >= 7)
+
+    def gunzip(self, data):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+    def test_html_is_gzipped_when_accepted(self):
+        plain = self.app.get('/')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+        response = self.app.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEquals(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEquals(self.gunzip(response.data), plain.data)
+        self.assertEquals(int(response.headers['Content-Length']),
+                          len(response.data))
+
+    def test_small_or_refused_responses_are_not_compressed(self):
+        response = self.app.get('api/v2/tasks/',
+                                headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        response = self.app.get('/', headers={
+            'Accept-Encoding': 'gzip;q=0, identity'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_streamed_export_is_compressed_per_chunk(self):
+        db.session.execute(Task.__table__.insert(), [
+            {'name': 'task {}'.format(i), 'due_date': date(2015, 1, 1),
+             'priority': 1, 'posted_date': date(2015, 1, 1), 'status': 1,
+             'user_id': 1} for i in range(1200)])
+        db.session.commit()
+        plain = self.app.get('api/v2/tasks/export?format=ndjson')
+        response = self.app.get('api/v2/tasks/export?format=ndjson',
+                                headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(response.is_streamed)
+        self.assertEquals(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertEquals(self.gunzip(response.data), plain.data)
+        self.assertTrue(len(response.data) < len(plain.data) / 4)
+
+    def test_pages_link_fingerprinted_assets(self):
+        response = self.app.get('/')
+        with app.test_request_context():
+            url = asset_manifest.url('css/main.css')
+        self.assertRegexpMatches(
+            url, r'^/assets/css/main\.[0-9a-f]{12}\.css$')
+        self.assertIn(url.encode(), response.data)
+
+    def test_fingerprinted_assets_are_cached_for_a_year(self):
+        with app.test_request_context():
+            url = asset_manifest.url('css/main.css')
+        with open(os.path.join(app.static_folder, 'css', 'main.css'),
+                  'rb') as f:
+            source = f.read()
+        response = self.app.get(url)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.mimetype, 'text/css')
+        self.assertEquals(response.headers['Cache-Control'],
+                          'public, max-age=31536000, immutable')
+        self.assertEquals(response.data, source)
+        response = self.app.get('/assets/css/main.000000000000.css')
+        self.assertEquals(response.status_code, 404)
+
+    def test_precompressed_assets_are_served_gzipped(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, 'site.css'), 'w') as f:
+                f.write('body { color: red; }')
+            written = precompress(directory)
+            self.assertEquals(written,
+                              [os.path.join(directory, 'site.css.gz')])
+            other = Flask('assets_test', static_folder=directory)
+            other.config['ASSETS_MAX_AGE'] = 60
+            manifest = AssetManifest(other)
+            with other.test_request_context():
+                url = manifest.url('site.css')
+            response = other.test_client().get(
+                url, headers={'Accept-Encoding': 'gzip'})
+            self.assertEquals(response.headers['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', response.headers['Vary'])
+            self.assertEquals(self.gunzip(response.data),
+                              b'body { color: red; }')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_stale_precompressed_assets_are_ignored(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, 'site.css'), 'w') as f:
+                f.write('body { color: red; }')
+            stale = gzip.open(os.path.join(directory, 'site.css.gz'), 'wb')
+            stale.write(b'body { color: blue; }')
+            stale.close()
+            other = Flask('assets_test', static_folder=directory)
+            other.config['ASSETS_MAX_AGE'] = 60
+            manifest = AssetManifest(other)
+            with other.test_request_context():
+                url = manifest.url('site.css')
+            response = other.test_client().get(
+                url, headers={'Accept-Encoding': 'gzip'})
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEquals(response.data, b'body { color: red; }')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_precompiled_templates_load_without_compiling(self):
+        directory = tempfile.mkdtemp()
+        try:
+            config = {'TESTING': True, 'TEMPLATE_CACHE_DIR': directory}
+            names = precompile(create_app(config))
+            self.assertIn('tasks.html', names)
+            self.assertEquals(len(os.listdir(directory)), len(names))
+            other = create_app(config)
+
+            def compile(*args, **kwargs):
+                raise AssertionError('compiled from source')
+            other.jinja_env.compile = compile
+            for name in names:
+                other.jinja_env.get_template(name)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_stale_or_damaged_template_bytecode_is_recompiled(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = os.path.join(directory, 'cache')
+
+            def render():
+                other = Flask('templates_test', template_folder=directory)
+                other.config['TEMPLATE_CACHE_DIR'] = cache
+                init_template_cache(other)
+                return other.jinja_env.get_template('page.html').render()
+
+            with open(os.path.join(directory, 'page.html'), 'w') as f:
+                f.write('one')
+            self.assertEquals(render(), 'one')
+            with open(os.path.join(directory, 'page.html'), 'w') as f:
+                f.write('two')
+            self.assertEquals(render(), 'two')
+            for name in os.listdir(cache):
+                with open(os.path.join(cache, name), 'wb') as f:
+                    f.write(b'j2')
+            self.assertEquals(render(), 'two')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_factory_apps_use_their_own_config_and_database(self):
+        directory = tempfile.mkdtemp()
+        try:
+            other = create_app({
+                'TESTING': True, 'SQL_INSTRUMENTATION': False,
+                'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(
+                    directory, 'other.db')})
+            self.assertIsNot(other, app)
+            self.assertFalse(other.config['SQL_INSTRUMENTATION'])
+            with other.app_context():
+                db.create_all()
+                db.session.add(User('other', 'other@example.com', 'x'))
+                db.session.commit()
+                self.assertEquals(User.query.count(), 1)
+                db.session.remove()
+            self.assertEquals(User.query.count(), 0)
+            response = other.test_client().get('api/v2/tasks/')
+            self.assertEquals(response.status_code, 200)
+            self.assertNotIn('Server-Timing', response.headers)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_factory_apps_do_not_share_extension_state(self):
+        directory = tempfile.mkdtemp()
+        listeners = lambda: (len(db.engine.pool.dispatch.connect),
+                             len(db.engine.dispatch.before_cursor_execute))
+        before = listeners()
+        try:
+            for _ in range(3):
+                other = create_app({
+                    'TESTING': True, 'COMPRESS_MIN_SIZE': 10 ** 9,
+                    'TASK_CACHE_TTL': 0, 'METRICS_DIR': directory,
+                    'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(
+                        directory, 'other.db')})
+            self.assertEquals(other.extensions['compressor'].min_size,
+                              10 ** 9)
+            self.assertEquals(metrics.directory, app.config['METRICS_DIR'])
+            self.assertEquals(task_cache.ttl, app.config['TASK_CACHE_TTL'])
+            with other.app_context():
+                self.assertIs(task_cache._get_current_object(),
+                              other.extensions['task_cache'])
+            response = self.app.get('/', headers={'Accept-Encoding': 'gzip'})
+            self.assertEquals(response.headers['Content-Encoding'], 'gzip')
+            # the pragma and timing listeners are on each app's engines
+            self.assertEquals(listeners(), before)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_exited_workers_are_folded_into_one_file(self):
+        import gunicorn_config
+        directory = tempfile.mkdtemp()
+        saved = metrics.directory
+        metrics.directory = directory
+        try:
+            for pid in (1, 2):
+                worker = {'requests': [['tasks', 'tasks.tasks', 'GET', '200',
+                                        pid]],
+                          'latency': [['tasks', 'tasks.tasks',
+                                       [pid, 0, 0.5]]],
+                          'size': [],
+                          'collectors': {
+                              'flasktaskr_task_cache_hits_total': 3,
+                              'flasktaskr_bcrypt_queued': 4}}
+                with open(os.path.join(directory, 'metrics-{}.json'.format(
+                        pid)), 'w') as f:
+                    json.dump(worker, f)
+                gunicorn_config.child_exit(None, Worker(pid))
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['metrics-exited.json', 'metrics.lock'])
+            merged = metrics.collect()
+        finally:
+            metrics.directory = saved
+            shutil.rmtree(directory)
+        key = ('tasks', 'tasks.tasks')
+        self.assertEqual(merged['requests'][key + ('GET', '200')], 3)
+        self.assertEqual(merged['latency'][key][:-1], [3, 0])
+        self.assertTrue(
+            merged['collectors']['flasktaskr_task_cache_hits_total'] >= 6)
+        # nothing is queued in a worker that has exited
+        self.assertEqual(
+            merged['collectors'].get('flasktaskr_bcrypt_queued', 0), 0)
+
+    def test_idle_workers_are_flushed_for_other_workers(self):
+        directory = tempfile.mkdtemp()
+        worker = subprocess.Popen(
+            [sys.executable, '-c', IDLE_WORKER, directory, '5'],
+            cwd=os.path.dirname(basedir), stdout=subprocess.PIPE)
+        try:
+            self.assertEqual(worker.stdout.readline().strip(), b'served')
+            other = Metrics()
+            other.directory = directory
+            key = ('', 'index', 'GET', '200')
+            deadline = time.time() + 5
+            while True:
+                served = other.collect()['requests'].get(key, 0)
+                if served == 5 or time.time() > deadline:
+                    break
+                time.sleep(0.05)
+        finally:
+            worker.kill()
+            worker.wait()
+            shutil.rmtree(directory)
+        self.assertEqual(served, 5)
+
+    def test_metrics_from_a_reused_pid_are_kept(self):
+        directory = tempfile.mkdtemp()
+        saved = metrics.directory, metrics._last_dump
+        metrics.directory, metrics._last_dump = directory, 0
+        try:
+            dead = {'requests': [['users', 'users.login', 'GET', '200', 9]],
+                    'latency': [], 'size': [], 'collectors': {}}
+            with open(os.path.join(directory, 'metrics-{}.json'.format(
+                    os.getpid())), 'w') as f:
+                json.dump(dead, f)
+            merged = metrics.collect()
+        finally:
+            metrics.directory, metrics._last_dump = saved
+            shutil.rmtree(directory)
+        self.assertTrue(
+            merged['requests'][('users', 'users.login', 'GET', '200')] >= 9)
+
+    def test_debug_and_production_apps_have_the_same_routes(self):
+        config = {'TESTING': True, 'SQLALCHEMY_DATABASE_URI':
+                  app.config['SQLALCHEMY_DATABASE_URI']}
+        rules = lambda a: sorted(r.rule for r in a.url_map.iter_rules())
+        production = create_app(config)
+        self.assertIn('/api/v2/tasks/', rules(production))
+        self.assertEqual(rules(production),
+                         rules(create_app(dict(config, DEBUG=True))))
+
+    def test_lazy_api_blueprints_are_registered_before_first_request(self):
+        config = {'TESTING': True, 'SQLALCHEMY_DATABASE_URI':
+                  app.config['SQLALCHEMY_DATABASE_URI']}
+        rules = lambda a: sorted(r.rule for r in a.url_map.iter_rules())
+        lazy = create_app(dict(config, LAZY_API_BLUEPRINTS=True))
+        self.assertNotIn('apitasklist', lazy.view_functions)
+        self.assertEquals(lazy.test_client().get('/').status_code, 200)
+        self.assertEquals(rules(lazy), rules(create_app(config)))
+        response = create_app(dict(config, LAZY_API_BLUEPRINTS=True)) \
+            .test_client().get('api/v2/tasks/')
+        self.assertEquals(response.status_code, 200)
+
+    def test_gunicorn_master_clears_metrics(self):
+        import gunicorn_config
+        directory = tempfile.mkdtemp()
+        saved = metrics.directory
+        metrics.directory = directory
+        try:
+            with open(os.path.join(directory, 'metrics-1.json'), 'w') as f:
+                f.write('{}')
+            gunicorn_config.on_starting(None)
+            self.assertEqual(os.listdir(directory), [])
+        finally:
+            metrics.directory = saved
+            shutil.rmtree(directory)
+        self.assertTrue(gunicorn_config.preload_app)
+        self.assertTrue(gunicorn_config.workers >= 1)
+
     def test_index(self):
         """Ensure flask was set up properly. """
         response = self.app.get('/', content_type='html/text')
@@ -1,9 +1,16 @@
 import os
+import json
+import re
+import time
 import unittest
+from datetime import date
 
-from project import app, db, bcrypt
+from sqlalchemy import event
+
+from project import app, db, bcrypt, task_cache, metrics
 from project._config import basedir
-from project.models import User
+from project.cache import QueryCache
+from project.models import Task, User
 
 TEST_DB = 'test.db'
 
@@ -46,6 +53,30 @@ class TaskTest(unittest.TestCase):
             status='1'
         ), follow_redirects=True)
 
+    def add_tasks_for_users(self, start, stop):
+        for i in range(start, stop):
+            user = User(name='user{}'.format(i),
+                        email='user{}@realpython.com'.format(i),
+                        password='x')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Task('Task {}'.format(i), date(2015, 2, 5), 1,
+                                date(2015, 2, 4), str(i % 2), user.id))
+        db.session.commit()
+
+    def count_queries(self, url):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.app.get(url, follow_redirects=True)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return len(statements)
+
     def create_admin_user(self):
         new_user = User(
             name='Superman',
@@ -69,6 +100,7 @@ class TaskTest(unittest.TestCase):
             os.path.join(basedir, TEST_DB)
         self.app = app.test_client()
         db.create_all()
+        task_cache.clear()
 
     # executed after to each test
     def tearDown(self):
@@ -225,6 +257,162 @@ class TaskTest(unittest.TestCase):
         self.assertIn(b'complete/2/', response.data)
         self.assertIn(b'delete/2/', response.data)
 
+    def test_completing_and_deleting_tasks_updates_stats(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python2015')
+        self.login('Michael', 'python2015')
+        self.create_task()
+        self.create_task()
+        self.app.get('complete/1/')
+        stats = json.loads(self.app.get('api/v2/stats').data)
+        self.assertEquals((stats['open'], stats['closed']), (1, 1))
+        self.app.get('delete/1/')
+        stats = json.loads(self.app.get('api/v2/stats').data)
+        self.assertEquals((stats['open'], stats['closed']), (1, 0))
+        self.assertEquals(stats['by_user'], {'1': {'open': 1, 'closed': 0}})
+
+    def test_users_can_search_tasks(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python2015')
+        self.login('Michael', 'python2015')
+        self.create_task()
+        response = self.app.get('tasks/?q=bank')
+        self.assertIn(b'Search results:', response.data)
+        self.assertIn(b'<td width="200px">Go to the bank</td>', response.data)
+        response = self.app.get('tasks/?q=library')
+        self.assertIn(b'No tasks match "library".', response.data)
+
+    def test_tasks_page_query_count_does_not_grow_with_rows(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        self.add_tasks_for_users(0, 2)
+        task_cache.clear()
+        few = self.count_queries('tasks/')
+        self.add_tasks_for_users(2, 40)
+        task_cache.clear()
+        many = self.count_queries('tasks/')
+        self.assertTrue(few > 0)
+        self.assertEqual(few, many)
+
+    def test_tasks_page_is_served_from_cache_until_a_write(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        self.create_task()
+        self.app.get('tasks/')
+        before = task_cache.stats()
+        self.assertEqual(self.count_queries('tasks/'), 0)
+        self.assertEqual(task_cache.stats()['hits'], before['hits'] + 2)
+        self.app.get('complete/1/')
+        response = self.app.get('tasks/')
+        self.assertIn(b'Go to the bank', response.data)
+        self.assertEqual(task_cache.stats()['misses'], before['misses'] + 2)
+
+    def next_link(self, data, section):
+        # each section runs from its heading to the next one
+        heading = {'search': 'Search results:', 'open': 'Open tasks:',
+                   'closed': 'Closed tasks:'}[section]
+        html = [part for part in data.decode().split('<h2>')
+                if part.startswith(heading)][0]
+        match = re.search(r'href="([^"]*)">Next', html)
+        return match and match.group(1).replace('&amp;', '&')
+
+    def test_tasks_page_is_paginated_per_section(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        self.add_tasks_for_users(0, 10)
+        response = self.app.get('tasks/?per_page=2')
+        self.assertEqual(response.data.count(b'<td width="200px">'), 4)
+        self.assertIn(b'Task 0</td>', response.data)
+        self.assertNotIn(b'Task 4</td>', response.data)
+        self.assertIn(b'per_page=2', response.data)
+        self.assertNotIn(b'Previous', response.data)
+        # follow the open section to its last page; closed stays put
+        url = self.next_link(response.data, 'open')
+        response = self.app.get(url)
+        url = self.next_link(response.data, 'open')
+        response = self.app.get(url)
+        self.assertIn(b'Task 9</td>', response.data)
+        self.assertIn(b'Task 0</td>', response.data)
+        self.assertNotIn(b'Task 1</td>', response.data)
+        self.assertIn(b'Previous', response.data)
+        self.assertIsNone(self.next_link(response.data, 'open'))
+        url = self.next_link(response.data, 'closed')
+        response = self.app.get(url)
+        self.assertIn(b'Task 9</td>', response.data)
+        self.assertIn(b'Task 4</td>', response.data)
+        self.assertIn(b'Task 6</td>', response.data)
+        self.assertNotIn(b'Task 0</td>', response.data)
+        response = self.app.get('tasks/?open_cursor=tampered')
+        self.assertIn(b'Task 1</td>', response.data)
+        app.config['TASKS_MAX_PAGE_SIZE'] = 3
+        try:
+            response = self.app.get('tasks/?per_page=1000')
+        finally:
+            app.config['TASKS_MAX_PAGE_SIZE'] = 100
+        self.assertEqual(response.data.count(b'<td width="200px">'), 6)
+
+    def test_search_results_are_paginated(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        self.add_tasks_for_users(0, 10)
+        names = []
+        url = 'tasks/?q=task&per_page=3'
+        while url:
+            response = self.app.get(url)
+            results = response.data.decode().split('<h2>Open tasks:</h2>')[0]
+            names += re.findall(r'<td width="200px">(Task \d+)</td>',
+                                results)
+            url = self.next_link(response.data, 'search')
+        self.assertEqual(len(names), 10)
+        self.assertEqual(sorted(names), ['Task {}'.format(i)
+                                         for i in range(10)])
+        self.assertIn(b'q=task', response.data)
+        self.assertIn(b'Previous', response.data)
+        response = self.app.get(
+            'tasks/?q=task&per_page=3&search_cursor=tampered')
+        results = response.data.decode().split('<h2>Open tasks:</h2>')[0]
+        self.assertEqual(results.count('<td width="200px">Task'), 3)
+
+    def test_tasks_page_timing_includes_its_queries(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        self.create_task()
+        task_cache.clear()
+        response = self.app.get('tasks/')
+        self.assertNotIn('0 queries', response.headers['Server-Timing'])
+        response.data
+        # a streamed response's latency is observed once its body is sent
+        key = ('tasks', 'tasks.tasks')
+        before = sum(metrics.latency.get(key, [0, 0])[:-1])
+        response = self.app.get('tasks/')
+        self.assertEqual(sum(metrics.latency.get(key, [0, 0])[:-1]), before)
+        response.data
+        response.close()
+        self.assertEqual(sum(metrics.latency[key][:-1]), before + 1)
+
+    def test_tasks_page_is_streamed_and_flashes_once(self):
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        self.login('Michael', 'python')
+        response = self.create_task()
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertIn(b'New entry was successfully posted.', response.data)
+        response = self.app.get('tasks/')
+        self.assertIn(b'Go to the bank', response.data)
+        self.assertNotIn(b'New entry was successfully posted.', response.data)
+
+    def test_query_cache_evicts_least_recently_used_and_expired(self):
+        cache = QueryCache(maxsize=2, ttl=60)
+        cache.get_or_set('a', lambda: 1)
+        cache.get_or_set('b', lambda: 2)
+        cache.get_or_set('a', lambda: 0)
+        cache.get_or_set('c', lambda: 3)
+        self.assertEqual(cache.get_or_set('a', lambda: 0), 1)
+        self.assertEqual(cache.get_or_set('b', lambda: 0), 0)
+
+        cache = QueryCache(maxsize=2, ttl=0.01)
+        cache.get_or_set('a', lambda: 1)
+        time.sleep(0.02)
+        self.assertEqual(cache.get_or_set('a', lambda: 2), 2)
+        self.assertEqual(cache.stats()['misses'], 2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,9 +1,13 @@
 import os
+import threading
+import time
 import unittest
 
-from project import app, db, bcrypt
+from project import app, db, bcrypt, task_cache
 from project._config import basedir
+from project.hashing import PasswordHasher, HashingBusy
 from project.models import User
+from project.users import views as users_views
 
 TEST_DB = 'test.db'
 
@@ -58,6 +62,7 @@ class UserTest(unittest.TestCase):
             os.path.join(basedir, TEST_DB)
         self.app = app.test_client()
         db.create_all()
+        task_cache.clear()
 
         self.assertEquals(app.debug, False)
 
@@ -157,6 +162,91 @@ class UserTest(unittest.TestCase):
         self.assertIn(b'Fletcher', response.data)
 
 
+    def test_password_hasher_rejects_work_when_queue_is_full(self):
+        hasher = PasswordHasher(bcrypt, workers=1, queue_size=1)
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        running = threading.Thread(target=hasher.submit, args=(block,))
+        running.start()
+        started.wait()
+        waiting = threading.Thread(target=hasher.submit, args=(block,))
+        waiting.start()
+        while hasher.stats()['queued'] != 1:
+            time.sleep(0.01)
+        self.assertRaises(HashingBusy, hasher.submit, block)
+        release.set()
+        running.join()
+        waiting.join()
+        stats = hasher.stats()
+        self.assertEquals(stats['rejected'], 1)
+        self.assertEquals(stats['completed'], 2)
+
+    def test_password_hasher_checks_passwords(self):
+        hasher = PasswordHasher(bcrypt, workers=2, queue_size=4)
+        pw_hash = hasher.generate_password_hash('python')
+        self.assertTrue(hasher.check_password_hash(pw_hash, 'python'))
+        self.assertFalse(hasher.check_password_hash(pw_hash, 'django'))
+
+    def test_login_returns_503_when_hasher_is_busy(self):
+        class BusyHasher(object):
+            def check_password_hash(self, pw_hash, password):
+                raise HashingBusy()
+
+        self.register('Michael', 'michael@realpython.com', 'python',
+                      'python')
+        hasher = users_views.password_hasher
+        users_views.password_hasher = BusyHasher()
+        try:
+            response = self.login('Michael', 'python')
+        finally:
+            users_views.password_hasher = hasher
+        self.assertEquals(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+
+    def test_concurrent_logins_beyond_the_queue_are_shed(self):
+        release = threading.Event()
+
+        class SlowBcrypt(object):
+            def check_password_hash(self, pw_hash, password):
+                release.wait()
+                return bcrypt.check_password_hash(pw_hash, password)
+
+        self.create_user('Michael', 'michael@realpython.com', 'python')
+        config = dict(app.config)
+        hasher = app.extensions['password_hasher']
+        app.config.update(WORKER_THREADS=4, BCRYPT_WORKERS=1,
+                          BCRYPT_QUEUE_SIZE=None)
+        app.extensions['password_hasher'] = PasswordHasher(SlowBcrypt(), app)
+        statuses = []
+
+        def login():
+            response = app.test_client().post('/', data=dict(
+                name='Michael', password='python'))
+            statuses.append(
+                (response.status_code, 'Retry-After' in response.headers))
+
+        # one login per request thread, as a gthread worker would run them
+        threads = [threading.Thread(target=login) for _ in range(4)]
+        try:
+            for thread in threads:
+                thread.start()
+            deadline = time.time() + 10
+            while len(statuses) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            release.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            release.set()
+            app.config.update(config)
+            app.extensions['password_hasher'] = hasher
+        self.assertEquals(sorted(statuses), [
+            (302, False), (302, False), (503, True), (503, True)])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,7 @@
+# wsgi.py
+#
+# Production entry point: gunicorn -c gunicorn_config.py wsgi:app
+# (run.py is the development server).
+
+
+from project import app